@@ -2,7 +2,9 @@
 import streamlit as st
 
 from core.sb_client import get_clients
+from core import diskcache
 from core.context import init_context
+from core.crud import db_view_available
 from core.ui import inject_css, app_header, switch_to_tab_by_label
 from core.utils import to_bool
 from tabs import home, importar, consultar, relatorios, quitacao, sistema
@@ -14,7 +16,11 @@ app_header("Sistema de Internações — Supabase", "Importação, edição, qui
 supabase, admin_client = get_clients()
 init_context(supabase, admin_client)
 
-USE_DB_VIEW = to_bool(st.secrets.get("USE_DB_VIEW", False))
+# Cache em disco opcional, compartilhado pelos processos do nó (core/diskcache.py).
+diskcache.configure(st.secrets.get("DISK_CACHE_DIR"))
+
+# Sonda a view uma única vez por processo; sem ela, usa embedding do PostgREST.
+USE_DB_VIEW = to_bool(st.secrets.get("USE_DB_VIEW", False)) and db_view_available()
 
 tabs_ui = st.tabs([
     "🏠 Início",
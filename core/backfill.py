@@ -0,0 +1,95 @@
+# core/backfill.py
+from __future__ import annotations
+from collections import defaultdict
+from typing import Callable, Optional
+
+from core.context import sb
+from core.filters import dt_col
+from core.utils import pt_date_to_dt
+
+BATCH = 500
+
+# (tabela, campo texto) -> coluna date <campo>_dt (sql/002_datas_iso.sql)
+TARGETS = [
+    ("internacoes", "data_internacao"),
+    ("procedimentos", "data_procedimento"),
+    ("procedimentos", "quitacao_data"),
+]
+
+def _to_date(s):
+    """Como public.pt_date (sql/002): ISO com hora (aaaa-mm-ddT...) usa só a data."""
+    return pt_date_to_dt(s) or pt_date_to_dt(str(s or "").strip()[:10])
+
+def _pending(q, col: str):
+    """Linhas com texto em formato de data e coluna tipada ainda vazia."""
+    return (
+        q.is_(dt_col(col), None)
+        .or_(f"{col}.like.__/__/____,{col}.like.____-__-__*")
+    )
+
+def _migratable(client, table: str, col: str) -> bool:
+    """
+    Alguma pendente tem data válida? Texto com cara de data mas inválido
+    (ex.: 00/00/0000) nunca ganha coluna tipada e não pode travar a migração.
+    Antes do backfill, responde na primeira página; depois, só percorre as inválidas.
+    """
+    cursor = 0
+    while True:
+        rows = (
+            _pending(client.table(table).select(f"id, {col}"), col)
+            .gt("id", cursor).order("id").limit(BATCH).execute().data or []
+        )
+        if not rows:
+            return False
+        if any(_to_date(r.get(col)) for r in rows):
+            return True
+        cursor = rows[-1]["id"]
+
+def pending_rows(client=None) -> int:
+    """
+    Quantas linhas ainda faltam migrar (somando os três campos).
+    Campo cujas pendentes são todas texto inválido conta como migrado.
+    """
+    client = client or sb()
+    total = 0
+    for table, col in TARGETS:
+        res = _pending(client.table(table).select("id", count="exact", head=True), col).execute()
+        n = int(res.count or 0)
+        if n and _migratable(client, table, col):
+            total += n
+    return total
+
+def backfill_datas(batch: int = BATCH, client=None,
+                   on_progress: Optional[Callable[[str, str, int], None]] = None) -> dict[str, int]:
+    """
+    Preenche as colunas date a partir do texto, em lotes pequenos por keyset
+    (transações curtas, seguro com o banco em uso). Retomável: só lê linhas
+    ainda vazias, então pode ser interrompido e rodado de novo a qualquer hora.
+    Cada lote vira um UPDATE ... WHERE id IN (...) por dia distinto.
+    """
+    client = client or sb()
+    report: dict[str, int] = {}
+    for table, col in TARGETS:
+        cursor, done = 0, 0
+        while True:
+            rows = (
+                _pending(client.table(table).select(f"id, {col}"), col)
+                .gt("id", cursor).order("id").limit(batch).execute().data or []
+            )
+            if not rows:
+                break
+            cursor = rows[-1]["id"]
+
+            by_day: dict[str, list[int]] = defaultdict(list)
+            for r in rows:
+                d = _to_date(r.get(col))
+                if d:
+                    by_day[d.isoformat()].append(int(r["id"]))
+            for iso, ids in by_day.items():
+                client.table(table).update({dt_col(col): iso}).in_("id", ids).execute()
+                done += len(ids)
+
+            if on_progress:
+                on_progress(table, col, done)
+        report[f"{table}.{col}"] = done
+    return report
@@ -10,6 +10,7 @@ from postgrest import APIError
 from core.context import sb, admin
 from core.sb_client import sb_debug_error
 from core.cache import invalidate_caches
+from core.paging import PAGE_SIZE, fetch_all
 from core.utils import to_ddmmyyyy, att_norm, att_to_number
 
 BUCKET = st.secrets.get("STORAGE_BACKUP_BUCKET", "backups")
@@ -17,22 +18,15 @@ BUCKET = st.secrets.get("STORAGE_BACKUP_BUCKET", "backups")
 def now_ts() -> str:
     return datetime.now().strftime("%Y%m%d_%H%M%S")
 
-def _fetch_all_rows(table: str, cols: str = "*", page_size: int = 1000,
+def _fetch_all_rows(table: str, cols: str = "*", page_size: int = PAGE_SIZE,
                     filters: Dict[str, Any] = None, client=None) -> List[Dict[str, Any]]:
-    client = client or sb()
-    rows, start = [], 0
-    while True:
-        q = client.table(table).select(cols).range(start, start + page_size - 1)
-        if filters:
-            for k, v in filters.items():
-                q = q.eq(k, v)
-        res = q.execute()
-        chunk = res.data or []
-        rows.extend(chunk)
-        if len(chunk) < page_size:
-            break
-        start += page_size
-    return rows
+    """Leitura completa por keyset em id, fatias paralelas (ver core.paging)."""
+    def _eq(q):
+        for k, v in (filters or {}).items():
+            q = q.eq(k, v)
+        return q
+    return fetch_all(table, cols, filters=_eq if filters else None,
+                     client=client or sb(), page_size=page_size)
 
 def export_tables_to_zip(tables: List[str]) -> bytes:
     """Gera ZIP com meta.json + {t}.json + {t}.csv. Usa admin() para não sofrer RLS."""
@@ -162,6 +156,7 @@ def restore_from_zip(zip_bytes: bytes, mode: str = "upsert") -> Dict[str, Any]:
                         r["atendimento"] = att_norm(r["atendimento"])
                     if "numero_internacao" in r:
                         r["numero_internacao"] = att_to_number(r["numero_internacao"])
+                    r.pop("atendimento_key", None)  # coluna gerada (sql/004)
                 c = _chunked_upsert("internacoes", rows)
                 report["details"].append(f"internacoes: {c} registro(s) restaurado(s).")
 
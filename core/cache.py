@@ -1,13 +1,359 @@
 # core/cache.py
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable, Iterable, Optional
+
+import pandas as pd
 import streamlit as st
 
+# Frames cacheados são compartilhados entre sessões e devolvidos como cópias
+# rasas: com copy-on-write (padrão no pandas 3) quem altera a cópia não
+# toca os dados do cache, e ninguém paga cópia profunda por acesso.
+if int(pd.__version__.split(".", 1)[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
 TTL_LONG  = 300
 TTL_MED   = 180
 TTL_SHORT = 120
 
+# ---- Tags ----
+# "tabela" depende da tabela inteira; "tabela:chave" de uma parte dela.
+# Invalidar "procedimentos:7" derruba as entradas dessa chave e as que
+# dependem da tabela inteira; invalidar "procedimentos" derruba todas.
+
+def tags_hit(entry_tags: Iterable[str], tags: Iterable[str]) -> bool:
+    """Alguma tag da entrada é atingida por alguma tag invalidada?"""
+    for e in entry_tags:
+        for t in tags:
+            if e == t or e.startswith(t + ":") or t.startswith(e + ":"):
+                return True
+    return False
+
+_INVALIDATION_HOOKS: list[Callable[[Optional[frozenset]], None]] = []
+
+def on_invalidate(fn: Callable[[Optional[frozenset]], None]) -> Callable[[Optional[frozenset]], None]:
+    """Registra um cache próprio; recebe as tags invalidadas (None = todas)."""
+    _INVALIDATION_HOOKS.append(fn)
+    return fn
+
+class LRUCache:
+    """LRU pequeno e limitado, com validade e tags por entrada (thread-safe)."""
+    def __init__(self, maxsize: int = 128, ttl: float = TTL_SHORT):
+        self.maxsize, self.ttl = maxsize, ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0  # muda a cada remoção: resultado em voo anterior não é gravado
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        hit = self.peek(key)
+        return default if hit is None else hit[1]
+
+    def peek(self, key: Hashable) -> Optional[tuple[float, Any]]:
+        """(idade em segundos, valor) da entrada válida; None se ausente/expirada."""
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is None:
+                return None
+            age = time.monotonic() - hit[0]
+            if age > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return age, hit[1]
+
+    def put(self, key: Hashable, value: Any, tags: Iterable[str] = ()) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic(), value, frozenset(tags))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def patch(self, key: Hashable, fn: Callable[[Any], Any]) -> bool:
+        """Troca o valor da entrada por fn(valor) mantendo idade e tags; None remove."""
+        with self._lock:
+            hit = self._data.get(key)
+            self.generation += 1
+            if hit is None:
+                return False
+            value = fn(hit[1])
+            if value is None:
+                del self._data[key]
+                return False
+            self._data[key] = (hit[0], value, hit[2])
+            return True
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+            self.generation += 1
+
+    def discard_where(self, pred: Callable[[Any], bool]) -> None:
+        """Remove as entradas cujo valor satisfaz `pred`."""
+        with self._lock:
+            for k in [k for k, (_, v, _) in self._data.items() if pred(v)]:
+                del self._data[k]
+            self.generation += 1
+
+    def discard_tags(self, tags: Iterable[str]) -> int:
+        """Remove as entradas atingidas por `tags`; devolve quantas."""
+        tags = tuple(tags)
+        with self._lock:
+            keys = [k for k, (_, _, et) in self._data.items() if tags_hit(et, tags)]
+            for k in keys:
+                del self._data[k]
+            if keys:
+                self.generation += 1
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.generation += 1
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+# ---- Registro de funções cacheadas ----
+
+def _copy(v: Any) -> Any:
+    """O chamador pode alterar o retorno sem sujar a entrada (sem copiar os dados)."""
+    if isinstance(v, (pd.DataFrame, pd.Series)):
+        return v.copy(deep=False)
+    if isinstance(v, (list, dict, set)):
+        return type(v)(v)
+    return v
+
+# ---- Versões por tabela (sql/006_data_versions.sql) ----
+# Com uma fonte de versões registrada (core.crud), uma entrada vale enquanto
+# as versões das tabelas das suas tags não mudarem (até VERSIONED_MAX_AGE);
+# o TTL fica só para o que não tem tabela versionada ou sem a fonte.
+VERSION_POLL = 5.0          # no máximo uma leitura de versões por processo a cada N s
+VERSIONED_MAX_AGE = 3600.0  # teto de segurança mesmo sem mudança de versão
+
+_version_source: Optional[Callable[[], Optional[dict]]] = None
+_versions: dict[str, int] = {}
+_versions_at = 0.0
+_versions_lock = threading.Lock()
+
+def set_version_source(fn: Optional[Callable[[], Optional[dict]]]) -> None:
+    """`fn()` devolve {tabela: versão} ou None (fonte indisponível)."""
+    global _version_source, _versions_at
+    _version_source, _versions_at = fn, 0.0
+
+def table_versions() -> Optional[dict[str, int]]:
+    """Versões atuais, relidas no máximo a cada VERSION_POLL; None sem fonte."""
+    global _versions, _versions_at
+    if _version_source is None:
+        return None
+    with _versions_lock:
+        if time.monotonic() - _versions_at > VERSION_POLL:
+            got = _version_source()
+            if got is None:
+                return None
+            _versions, _versions_at = dict(got), time.monotonic()
+        return _versions
+
+def expire_versions() -> None:
+    """
+    Escrita deste processo: a próxima checagem relê as versões. Sem isso, a
+    leitura de até VERSION_POLL s atrás (de antes da escrita) não bate com a
+    versão esperada pelos remendos (+1) e a entrada remendada seria relida.
+    """
+    global _versions_at
+    with _versions_lock:
+        _versions_at = 0.0
+
+def versions_of(tags: Iterable[str], versions: Optional[dict]) -> Optional[dict[str, int]]:
+    """Versões das tabelas citadas em `tags` ("tabela" ou "tabela:chave")."""
+    if versions is None:
+        return None
+    return {t: versions[t] for t in {tag.split(":", 1)[0] for tag in tags} if t in versions}
+
+def versions_current(snapshot: Optional[dict]) -> Optional[bool]:
+    """True/False se dá para decidir pela versão; None se não dá (cai no TTL)."""
+    if not snapshot:
+        return None
+    cur = table_versions()
+    if cur is None:
+        return None
+    return all(cur.get(t) == v for t, v in snapshot.items())
+
+# Recargas em segundo plano (stale-while-revalidate); poucas threads bastam.
+_REFRESH_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-refresh")
+
+def refresh_in_background(fn: Callable[[], Any]) -> None:
+    _REFRESH_POOL.submit(fn)
+
+class _Flight:
+    """Uma busca em andamento; chamadas concorrentes da mesma chave esperam nela."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+class CachedFunction:
+    """
+    Memoização por argumentos com TTL, LRU limitado e tags de dependência.
+    `tags`: modelos formatados com os argumentos ("procedimentos:{internacao_id}");
+    `result_tags`: tags extraídas do próprio resultado (ex.: ids devolvidos).
+
+    Até `ttl` a entrada é fresca. Entre `ttl` e `ttl + max_stale` o valor velho
+    é servido na hora e uma thread recarrega (uma só por chave). Depois disso,
+    ou sem entrada, a busca é síncrona, e misses simultâneos da mesma chave
+    compartilham a mesma busca (single-flight). Invalidação remove a entrada:
+    depois de uma escrita nunca se serve valor velho. Se as tabelas das tags
+    têm versão (set_version_source), a entrada vale até a versão mudar.
+    """
+    def __init__(self, fn: Callable, ttl: float, maxsize: int, tags: Iterable[str],
+                 result_tags: Optional[Callable[[Any], Iterable[str]]], max_stale: float):
+        self.fn = fn
+        self.ttl = ttl
+        self.tags = tuple(tags)
+        self.result_tags = result_tags
+        self._sig = inspect.signature(fn)
+        self.max_stale = max_stale
+        self._store = LRUCache(maxsize=maxsize, ttl=max(ttl + max_stale, VERSIONED_MAX_AGE))
+        self._flights: dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+        functools.update_wrapper(self, fn)
+
+    def _bind(self, args, kwargs) -> dict:
+        b = self._sig.bind(*args, **kwargs)
+        b.apply_defaults()
+        return b.arguments
+
+    def _tags_for(self, bound: dict, value: Any) -> list[str]:
+        out = [t.format(**bound) for t in self.tags]
+        if self.result_tags:
+            out += list(self.result_tags(value))
+        return out
+
+    def _flight(self, key: Hashable) -> tuple[_Flight, bool]:
+        """(busca da chave, True se quem chamou deve executá-la)."""
+        with self._lock:
+            f = self._flights.get(key)
+            if f is not None:
+                return f, False
+            f = self._flights[key] = _Flight()
+            return f, True
+
+    def _run(self, key: Hashable, bound: dict, args, kwargs, f: _Flight) -> None:
+        gen = self._store.generation
+        before = table_versions()  # lidas ANTES: escrita durante a busca força nova leitura
+        try:
+            f.value = self.fn(*args, **kwargs)
+            tags = self._tags_for(bound, f.value)
+            # Invalidação durante a busca desliga a busca (_detach_flights) antes
+            # de remover entradas; checar e gravar sob o mesmo lock fecha a janela.
+            with self._lock:
+                if self._flights.get(key) is f and self._store.generation == gen:
+                    self._store.put(key, (f.value, versions_of(tags, before)), tags)
+        except BaseException as e:
+            f.error = e
+        finally:
+            with self._lock:
+                if self._flights.get(key) is f:
+                    del self._flights[key]
+            f.done.set()
+
+    def __call__(self, *args, **kwargs):
+        bound = self._bind(args, kwargs)
+        key = tuple(bound.items())
+        hit = self._store.peek(key)
+        if hit is not None:
+            age, (value, vers) = hit
+            same = versions_current(vers)
+            if same is True and age <= VERSIONED_MAX_AGE:
+                return _copy(value)
+            if same is None and age <= self.ttl + self.max_stale:
+                if age > self.ttl:
+                    f, owner = self._flight(key)
+                    if owner:
+                        refresh_in_background(lambda: self._run(key, bound, args, kwargs, f))
+                return _copy(value)
+            # versão mudou (outro usuário/processo escreveu) ou idade além do teto
+
+        f, owner = self._flight(key)
+        if owner:
+            self._run(key, bound, args, kwargs, f)
+        else:
+            f.done.wait()
+        if f.error is not None:
+            raise f.error
+        return _copy(f.value)
+
+    def _detach_flights(self) -> None:
+        """Quem chegar depois de uma invalidação não pega carona em busca anterior."""
+        with self._lock:
+            self._flights.clear()
+
+    def invalidate(self, tags: Iterable[str]) -> int:
+        self._detach_flights()
+        return self._store.discard_tags(tags)
+
+    def patch(self, fn: Callable[[Any], Any], *args, **kwargs) -> bool:
+        """
+        Write-through: aplica `fn` à entrada destes argumentos, se houver.
+        O remendo corresponde a UM comando de escrita: a versão esperada das
+        tabelas da entrada sobe 1 (se outro também escreveu, a versão não
+        bate e a próxima leitura vai ao banco).
+        """
+        key = tuple(self._bind(args, kwargs).items())
+        self._detach_flights()
+
+        def _apply(entry):
+            value, vers = entry
+            new = fn(value)
+            if new is None:
+                return None
+            return new, ({t: v + 1 for t, v in vers.items()} if vers else vers)
+        return self._store.patch(key, _apply)
+
+    def clear(self) -> None:
+        self._detach_flights()
+        self._store.clear()
+
+_REGISTRY: list[CachedFunction] = []
+
+def cached(ttl: float = TTL_MED, maxsize: int = 64, tags: Iterable[str] = (),
+           result_tags: Optional[Callable[[Any], Iterable[str]]] = None,
+           max_stale: Optional[float] = None):
+    """
+    Decorator: registra a função no cache com as tags de que ela depende.
+    `max_stale`: quanto tempo após o TTL ainda se serve o valor velho enquanto
+    recarrega (padrão: o próprio TTL; 0 desliga o stale-while-revalidate).
+    """
+    def deco(fn: Callable) -> CachedFunction:
+        cf = CachedFunction(fn, ttl, maxsize, tags, result_tags, ttl if max_stale is None else max_stale)
+        _REGISTRY.append(cf)
+        return cf
+    return deco
+
+def invalidate(*tags: str, keep: Iterable[Any] = ()) -> int:
+    """
+    Invalida só o que depende de `tags` (chame após cada escrita).
+    `keep`: funções cacheadas/hooks já remendados pela própria escrita.
+    """
+    keep = tuple(keep)
+    expire_versions()
+    n = sum(cf.invalidate(tags) for cf in _REGISTRY if not any(cf is k for k in keep))
+    for fn in _INVALIDATION_HOOKS:
+        if not any(fn is k for k in keep):
+            fn(frozenset(tags))
+    return n
+
 def invalidate_caches():
-    """Invalida TODOS os caches (chame após qualquer CRUD)."""
+    """Invalida TODOS os caches (restauração de backup, migrações)."""
     try:
         st.cache_data.clear()
     except Exception:
         pass
+    expire_versions()
+    for cf in _REGISTRY:
+        cf.clear()
+    for fn in _INVALIDATION_HOOKS:
+        fn(None)
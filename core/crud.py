@@ -1,15 +1,145 @@
 # core/crud.py
 from __future__ import annotations
+import itertools
+import re
+import threading
+import time
 import streamlit as st
 import pandas as pd
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timezone
+from typing import Callable, Optional
 from postgrest import APIError
 
-from core.cache import TTL_LONG, TTL_MED, TTL_SHORT, invalidate_caches
+from core.cache import (
+    TTL_LONG, TTL_MED, TTL_SHORT, VERSIONED_MAX_AGE, cached, invalidate, on_invalidate,
+    refresh_in_background, set_version_source, table_versions, tags_hit, versions_current, versions_of,
+)
+from core import diskcache
 from core.context import sb
+from core.backfill import pending_rows
+from core.filters import ProcFilter, dates_of, dt_col
+from core.paging import FetchStats, fetch_all, iter_keyset
 from core.sb_client import sb_debug_error
-from core.utils import to_ddmmyyyy, att_norm, att_to_number, safe_merge, pt_date_to_dt
+from core.utils import to_ddmmyyyy, att_key, att_norm, att_to_number, pt_date_to_dt
 
-@st.cache_data(ttl=TTL_LONG, show_spinner=False)
+def _flatten_embedded(chunk: list[dict], embed: str) -> list[dict]:
+    """Achata o recurso embutido (many-to-one) nas colunas da linha."""
+    for r in chunk:
+        for k, v in (r.pop(embed, None) or {}).items():
+            r.setdefault(k, v)
+    return chunk
+
+def fetch_df(table: str, cols: str, filters: Optional[Callable] = None,
+             key: str = "id", embed: Optional[str] = None) -> tuple[pd.DataFrame, FetchStats]:
+    """Monta o DataFrame página a página (keyset paralelo), ordenado por `key`."""
+    stats = FetchStats()
+    frames = [
+        pd.DataFrame(_flatten_embedded(chunk, embed) if embed else chunk)
+        for chunk in iter_keyset(table, cols, key=key, filters=filters, stats=stats)
+    ]
+    if not frames:
+        return pd.DataFrame(), stats
+    df = pd.concat(frames, ignore_index=True)
+    return df.sort_values(key, kind="stable", ignore_index=True), stats
+
+def _with_stats(df: pd.DataFrame, stats: FetchStats, label: str) -> pd.DataFrame:
+    """Anota fetched/total em df.attrs e avisa se a carga veio incompleta."""
+    df.attrs["rows_fetched"] = stats.fetched
+    df.attrs["rows_total"] = stats.total
+    if not stats.complete:
+        st.warning(f"{label}: {stats.fetched} de {stats.total} linha(s) carregada(s).")
+    return df
+
+VIEW_PROC_INT = "vw_procedimentos_internacoes"
+
+@st.cache_resource(show_spinner=False)
+def db_view_available() -> bool:
+    """Sonda única por processo: a view procedimentos ⨝ internações existe?"""
+    try:
+        sb().table(VIEW_PROC_INT).select("procedimento_id").limit(1).execute()
+        return True
+    except APIError:
+        return False
+
+@st.cache_resource(show_spinner=False)
+def typed_dates_available(use_db_view: bool = False) -> bool:
+    """As colunas date (sql/002_datas_iso.sql) existem na origem de leitura?"""
+    try:
+        if use_db_view:
+            sb().table(VIEW_PROC_INT).select("data_procedimento_dt, quitacao_data_dt, data_internacao_dt").limit(1).execute()
+        else:
+            sb().table("procedimentos").select(
+                "data_procedimento_dt, quitacao_data_dt, internacoes(data_internacao_dt)"
+            ).limit(1).execute()
+        return True
+    except APIError:
+        return False
+
+@st.cache_resource(show_spinner=False)
+def typed_dates_ready() -> bool:
+    """Colunas existem e o backfill terminou: períodos podem ir ao índice."""
+    if not typed_dates_available():
+        return False
+    try:
+        return pending_rows() == 0
+    except APIError:
+        return False
+
+def with_typed_dates(payload: dict) -> dict:
+    """Acrescenta <campo>_dt (ISO) aos campos de data do payload, se as colunas existirem."""
+    if not typed_dates_available():
+        return payload
+    for col in ("data_internacao", "data_procedimento", "quitacao_data"):
+        if col in payload:
+            d = pt_date_to_dt(payload[col]) if payload[col] else None
+            payload[dt_col(col)] = d.isoformat() if d else None
+    return payload
+
+def fetch_proc_join(proc_cols: str, int_cols: str, flt: Optional[ProcFilter] = None,
+                    use_db_view: bool = False, extra: Optional[Callable] = None) -> tuple[pd.DataFrame, FetchStats]:
+    """
+    Procedimentos + colunas da internação em uma única requisição por página:
+    pela view (se habilitada e existente) ou por embedding do PostgREST
+    (procedimentos?select=...,internacoes(...)). `id` é sempre o do procedimento.
+    `flt` é compilado para filtros PostgREST (só o recorte atravessa a rede);
+    `extra` acrescenta filtros crus (ex.: updated_at na sincronização incremental).
+    """
+    flt = flt or ProcFilter()
+    view = use_db_view and db_view_available()
+    typed = typed_dates_ready() and typed_dates_available(view)
+
+    def _filters(q):
+        q = flt.apply(q, view=view, typed=typed)
+        return extra(q) if extra else q
+
+    if view:
+        df, stats = fetch_df(VIEW_PROC_INT, f"procedimento_id, {proc_cols}, {int_cols}",
+                             _filters, key="procedimento_id")
+        return df.rename(columns={"procedimento_id": "id"}), stats
+    embed = "internacoes!inner" if flt.needs_internacao else "internacoes"
+    df, stats = fetch_df("procedimentos", f"id, {proc_cols}, {embed}({int_cols})",
+                         _filters, embed="internacoes")
+    if flt.excluir_hospitais and not flt.int_range:
+        # O "resto" inclui procedimento sem internação, que o !inner deixa de fora.
+        rest = replace(flt, excluir_hospitais=())
+
+        def _orphans(q):
+            q = rest.apply(q, typed=typed).is_("internacoes", None)
+            return extra(q) if extra else q
+
+        orf, o_stats = fetch_df("procedimentos", f"id, {proc_cols}, internacoes({int_cols})",
+                                _orphans, embed="internacoes")
+        if not orf.empty:
+            df = pd.concat([df, orf], ignore_index=True).sort_values("id", kind="stable", ignore_index=True)
+        stats = FetchStats(
+            fetched=stats.fetched + o_stats.fetched,
+            total=None if stats.total is None or o_stats.total is None else stats.total + o_stats.total,
+            pages=stats.pages + o_stats.pages,
+        )
+    return df, stats
+
+@cached(ttl=TTL_LONG, tags=("hospitals",))
 def get_hospitais(include_inactive: bool = False) -> list[str]:
     try:
         q = sb().table("hospitals").select("name, active")
@@ -21,37 +151,60 @@ def get_hospitais(include_inactive: bool = False) -> list[str]:
         sb_debug_error(e, "Falha ao buscar hospitais.")
         return []
 
-def get_internacao_by_atendimento(att):
-    """Busca por atendimento normalizado e fallback por numero_internacao."""
+# Consulta por atendimento: uma busca indexada por chave canônica, cacheada
+# por chave (a aba Consultar chama a cada rerun). Escritas na internação
+# derrubam só a entrada dela (tags atendimento:<chave> e internacoes:<id>).
+@st.cache_resource(show_spinner=False)
+def atendimento_key_available() -> bool:
+    """Coluna atendimento_key (sql/004_atendimento_key.sql) existe?"""
     try:
-        an = att_norm(att)
-        res = sb().table("internacoes").select("*").eq("atendimento", an).execute()
-        df = pd.DataFrame(res.data or [])
-        if not df.empty:
-            return df
+        sb().table("internacoes").select("atendimento_key").limit(1).execute()
+        return True
+    except APIError:
+        return False
+
+def _ids_tags(table: str, col: str = "id"):
+    return lambda df: [f"{table}:{int(i)}" for i in df[col].dropna().unique()] if not df.empty else []
 
-        num = att_to_number(att)
-        if num is not None:
-            res2 = sb().table("internacoes").select("*").eq("numero_internacao", num).execute()
-            return pd.DataFrame(res2.data or [])
+@cached(ttl=TTL_MED, maxsize=256, tags=("atendimento:{key}",), result_tags=_ids_tags("internacoes"))
+def _lookup_internacao(key: int) -> pd.DataFrame:
+    q = sb().table("internacoes").select("*")
+    if atendimento_key_available():
+        return pd.DataFrame(q.eq("atendimento_key", key).execute().data or [])
+    # Sem a coluna: atendimento OU numero_internacao numa requisição só,
+    # preferindo o casamento exato do atendimento (como antes).
+    an = str(key)
+    df = pd.DataFrame(q.or_(f"atendimento.eq.{an},numero_internacao.eq.{float(key)}").execute().data or [])
+    if not df.empty and (df["atendimento"].astype(str) == an).any():
+        df = df[df["atendimento"].astype(str) == an].reset_index(drop=True)
+    return df
+
+def get_internacao_by_atendimento(att):
+    """Busca por atendimento normalizado (com fallback por numero_internacao)."""
+    key = att_key(att)
+    if key is None:
         return pd.DataFrame()
+    try:
+        return _lookup_internacao(key)
     except APIError as e:
         sb_debug_error(e, "Falha ao consultar internação.")
         return pd.DataFrame()
 
 def criar_internacao(hospital, atendimento, paciente, data, convenio):
-    payload = {
+    payload = with_typed_dates({
         "hospital": hospital,
         "atendimento": att_norm(atendimento),
         "paciente": paciente,
         "data_internacao": to_ddmmyyyy(data),
         "convenio": convenio,
         "numero_internacao": att_to_number(atendimento)
-    }
+    })
     try:
         res = sb().table("internacoes").insert(payload).execute()
         row = (res.data or [{}])[0]
-        invalidate_caches()
+        iid = row.get("id")
+        invalidate(f"atendimento:{att_key(atendimento)}", f"hospital:{hospital}",
+                   f"internacoes:{int(iid)}" if iid is not None else "internacoes")
         return int(row.get("id")) if row.get("id") is not None else None
     except APIError as e:
         sb_debug_error(e, "Falha ao criar internação.")
@@ -61,9 +214,11 @@ def atualizar_internacao(internacao_id, **kwargs):
     update_data = {k: v for k, v in kwargs.items() if v is not None}
     if "data_internacao" in update_data:
         update_data["data_internacao"] = to_ddmmyyyy(update_data["data_internacao"])
+        update_data = with_typed_dates(update_data)
     try:
         sb().table("internacoes").update(update_data).eq("id", int(internacao_id)).execute()
-        invalidate_caches()
+        moved = [f"hospital:{update_data['hospital']}"] if update_data.get("hospital") else []
+        invalidate(f"internacoes:{int(internacao_id)}", *moved)
     except APIError as e:
         sb_debug_error(e, "Falha ao atualizar internação.")
 
@@ -91,7 +246,7 @@ def deletar_internacao(internacao_id: int) -> bool:
         pos = sb().table("internacoes").select("id").eq("id", iid).limit(1).execute()
         ok = len(pos.data or []) == 0
         if ok:
-            invalidate_caches()
+            invalidate(f"internacoes:{iid}", f"procedimentos:{iid}")
             return True
         st.error("❌ Não foi possível excluir a internação. Verifique RLS/Policies/FKs.")
         return False
@@ -100,10 +255,17 @@ def deletar_internacao(internacao_id: int) -> bool:
         sb_debug_error(e, "Falha ao deletar internação.")
         return False
 
+def _proc_tags(rows) -> list[str]:
+    """Tags dos procedimentos escritos: por internação quando o retorno traz o vínculo."""
+    iids = {r.get("internacao_id") for r in (rows or [])}
+    if not iids or None in iids:
+        return ["procedimentos"]
+    return [f"procedimentos:{int(i)}" for i in iids]
+
 def criar_procedimento(internacao_id, data_proc, profissional, procedimento,
                        situacao="Pendente", observacao=None, is_manual=0,
                        aviso=None, grau_participacao=None):
-    payload = {
+    payload = with_typed_dates({
         "internacao_id": int(internacao_id),
         "data_procedimento": to_ddmmyyyy(data_proc),
         "profissional": profissional,
@@ -113,11 +275,11 @@ def criar_procedimento(internacao_id, data_proc, profissional, procedimento,
         "is_manual": int(is_manual or 0),
         "aviso": aviso,
         "grau_participacao": grau_participacao,
-    }
+    })
     try:
         res = sb().table("procedimentos").insert(payload).execute()
         data = res.data or []
-        invalidate_caches()
+        _write_through(data, f"procedimentos:{int(internacao_id)}", *(["profissionais"] if profissional else []))
         if not data:
             return None
         return int(data[0].get("id")) if data[0].get("id") is not None else True
@@ -136,14 +298,14 @@ def atualizar_procedimento(proc_id, procedimento=None, situacao=None,
     if not update_data:
         return
     try:
-        sb().table("procedimentos").update(update_data).eq("id", int(proc_id)).execute()
-        invalidate_caches()
+        res = sb().table("procedimentos").update(update_data).eq("id", int(proc_id)).execute()
+        _write_through(res.data, *_proc_tags(res.data))
     except APIError as e:
         sb_debug_error(e, "Falha ao atualizar procedimento.")
 
 def deletar_procedimento(proc_id: int) -> bool:
     try:
-        pre = sb().table("procedimentos").select("id").eq("id", int(proc_id)).limit(1).execute()
+        pre = sb().table("procedimentos").select("id, internacao_id").eq("id", int(proc_id)).limit(1).execute()
         if not (pre.data or []):
             st.info("Registro já não existe (nada a excluir).")
             return True
@@ -153,7 +315,7 @@ def deletar_procedimento(proc_id: int) -> bool:
         pos = sb().table("procedimentos").select("id").eq("id", int(proc_id)).limit(1).execute()
         ok = len(pos.data or []) == 0
         if ok:
-            invalidate_caches()
+            invalidate(*_proc_tags(pre.data))
             return True
         st.error("❌ Não foi possível excluir. Verifique RLS/Policies ou vínculos (FK).")
         return False
@@ -173,10 +335,10 @@ def quitar_procedimento(proc_id, data_quitacao=None, guia_amhptiss=None, valor_a
         "quitacao_observacao": quitacao_observacao,
         "situacao": "Finalizado",
     }
-    update_data = {k: v for k, v in update_data.items() if v is not None or k == "situacao"}
+    update_data = with_typed_dates({k: v for k, v in update_data.items() if v is not None or k == "situacao"})
     try:
-        sb().table("procedimentos").update(update_data).eq("id", int(proc_id)).execute()
-        invalidate_caches()
+        res = sb().table("procedimentos").update(update_data).eq("id", int(proc_id)).execute()
+        _write_through(res.data, *_proc_tags(res.data))
     except APIError as e:
         sb_debug_error(e, "Falha ao quitar procedimento.")
 
@@ -190,13 +352,14 @@ def reverter_quitacao(proc_id: int):
         "quitacao_observacao": None,
         "situacao": "Enviado para pagamento",
     }
+    update_data = with_typed_dates(update_data)
     try:
-        sb().table("procedimentos").update(update_data).eq("id", int(proc_id)).execute()
-        invalidate_caches()
+        res = sb().table("procedimentos").update(update_data).eq("id", int(proc_id)).execute()
+        _write_through(res.data, *_proc_tags(res.data))
     except APIError as e:
         sb_debug_error(e, "Falha ao reverter quitação.")
 
-@st.cache_data(ttl=TTL_SHORT, show_spinner=False)
+@cached(ttl=TTL_SHORT, maxsize=128, tags=("procedimentos:{internacao_id}",))
 def get_procedimentos(internacao_id):
     try:
         res = sb().table("procedimentos").select("*").eq("internacao_id", int(internacao_id)).execute()
@@ -205,152 +368,749 @@ def get_procedimentos(internacao_id):
         sb_debug_error(e, "Falha ao listar procedimentos.")
         return pd.DataFrame()
 
-@st.cache_data(ttl=TTL_MED, show_spinner=False)
-def listar_profissionais_cache() -> list[str]:
+@st.cache_resource(show_spinner=False)
+def profissionais_table_available() -> bool:
+    """Tabela profissionais (sql/005_profissionais.sql) existe?"""
+    try:
+        sb().table("profissionais").select("nome").limit(1).execute()
+        return True
+    except APIError:
+        return False
+
+def _like_prefix(prefix: str) -> str:
+    return re.sub(r"([\\%_])", r"\\\1", prefix.strip().lower()) + "%"
+
+@cached(ttl=TTL_MED, tags=("profissionais",))
+def listar_profissionais_cache(prefix: str = "", limit: Optional[int] = None) -> list[str]:
+    """
+    Nomes distintos de profissionais, em ordem; `prefix` filtra para autocomplete.
+    Lê o diretório mantido no banco; sem ele, varre procedimentos.profissional.
+    """
     try:
-        res = sb().table("procedimentos").select("profissional").execute()
-        df = pd.DataFrame(res.data or [])
-        if "profissional" not in df.columns:
-            return []
-        return sorted({str(x).strip() for x in df["profissional"].dropna() if str(x).strip()})
+        if profissionais_table_available():
+            flt = (lambda q: q.like("nome_busca", _like_prefix(prefix))) if prefix.strip() else None
+            if limit:
+                q = sb().table("profissionais").select("nome")
+                rows = (flt(q) if flt else q).order("nome").limit(int(limit)).execute().data or []
+            else:
+                rows = fetch_all("profissionais", "nome", key="nome", filters=flt)
+            return [r["nome"] for r in rows]
+
+        names: set[str] = set()
+        for chunk in iter_keyset("procedimentos", "id, profissional",
+                                 filters=lambda q: q.not_.is_("profissional", None)):
+            names.update(str(r["profissional"]).strip() for r in chunk if str(r.get("profissional") or "").strip())
+        pre = prefix.strip().lower()
+        out = sorted(n for n in names if n.lower().startswith(pre))
+        return out[:limit] if limit else out
     except APIError:
         return []
 
-@st.cache_data(ttl=TTL_MED, show_spinner=False)
-def home_fetch_base_df(use_db_view: bool = False) -> pd.DataFrame:
-    """Base Procedimentos + Internações para Home."""
-    if use_db_view:
-        try:
-            res = sb().table("vw_procedimentos_internacoes").select(
-                "procedimento_id, internacao_id, data_procedimento, procedimento, profissional, situacao, aviso, grau_participacao, "
-                "atendimento, paciente, hospital, convenio, data_internacao"
-            ).execute()
-            df = pd.DataFrame(res.data or [])
-            if "procedimento_id" in df.columns and "id" not in df.columns:
-                df = df.rename(columns={"procedimento_id": "id"})
-            return df
-        except APIError:
-            pass
+TIPOS_CIRURGIA = ["Cirurgia / Procedimento", "Parecer"]
+
+PROC_COLS = (
+    "internacao_id, data_procedimento, procedimento, profissional, situacao, aviso, grau_participacao, "
+    "quitacao_data, quitacao_guia_amhptiss, quitacao_valor_amhptiss, "
+    "quitacao_guia_complemento, quitacao_valor_complemento, quitacao_observacao"
+)
+INT_COLS = "atendimento, paciente, hospital, convenio, data_internacao"
+PROC_DT_COLS = "data_procedimento_dt, quitacao_data_dt"
+INT_DT_COLS = "data_internacao_dt"
+
+# ---- Schema dos datasets ----
+# Tipos compactos após cada busca: categorias para texto de baixa
+# cardinalidade, Int64 para ids, float64 para valores e datetime64 nas
+# colunas <data>_dt (tipadas do banco ou, na falta, parseadas do texto).
+# O texto das datas continua como veio: é o que as abas exibem/exportam.
+CATEGORY_COLS = ("hospital", "situacao", "procedimento", "profissional", "convenio", "grau_participacao")
+ID_COLS = ("id", "internacao_id")
+MONEY_COLS = ("quitacao_valor_amhptiss", "quitacao_valor_complemento")
+DATE_COLS = ("data_procedimento", "data_internacao", "quitacao_data")
+
+def _parse_dates(text: pd.Series) -> pd.Series:
+    """dd/mm/aaaa ou aaaa-mm-dd (os formatos de pt_date_to_dt) -> datetime64."""
+    t = text.astype("string").str.strip()
+    out = pd.to_datetime(t, format="%d/%m/%Y", errors="coerce")
+    iso = out.isna() & t.notna()
+    if iso.any():
+        out = out.where(~iso, pd.to_datetime(t.where(iso), format="%Y-%m-%d", errors="coerce"))
+    return out
+
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """Converte só as colunas que ainda não estão no tipo final."""
+    if df.empty:
+        return df
+    conv = {}
+    for c in CATEGORY_COLS:
+        if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            conv[c] = df[c].astype("category")
+    for c in ID_COLS:
+        if c in df.columns and df[c].dtype != "Int64":
+            conv[c] = pd.to_numeric(df[c], errors="coerce").astype("Int64")
+    for c in MONEY_COLS:
+        if c in df.columns and df[c].dtype != "float64":
+            conv[c] = pd.to_numeric(df[c], errors="coerce").astype("float64")
+    for c in DATE_COLS:
+        tc = dt_col(c)
+        if c not in df.columns or (tc in df.columns and pd.api.types.is_datetime64_any_dtype(df[tc])):
+            continue
+        typed = pd.to_datetime(df[tc], errors="coerce") if tc in df.columns else pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+        missing = typed.isna() & df[c].notna()
+        if missing.any():
+            typed = typed.where(~missing, _parse_dates(df[c].where(missing)))
+        conv[tc] = typed
+    return df.assign(**conv) if conv else df
+
+# ---- Datasets sincronizados incrementalmente (sql/003_delta_sync.sql) ----
+# Um por (use_db_view, filtro, hospital), no processo: cada hospital é uma
+# partição buscada, sincronizada e suja por conta própria; "Todos" é montado
+# das partições (mais a do resto, hospitais fora do cadastro). Quem só
+# trabalha com um hospital carrega só aquele. A 1ª carga é completa; depois,
+# a cada TTL_MED (ou após uma escrita) só entram as linhas com
+# updated_at acima da marca, as de internações alteradas, e saem as lápides.
+DELTA_OVERLAP = pd.Timedelta(seconds=5)  # cobre commits tardios com updated_at anterior
+FULL_RESYNC = 3600
+MAX_STALE = TTL_MED  # além do TTL, serve o atual enquanto atualiza em segundo plano
+DATASET_TABLES = ("procedimentos", "internacoes")
+MAX_SYNCED = 64
+MAX_ASSEMBLED = 8
+INT_CHUNK = 200
+
+@dataclass
+class _SyncedDataset:
+    df: pd.DataFrame = field(default_factory=pd.DataFrame)
+    delta: bool = False              # origem suporta updated_at/lápides
+    proc_mark: Optional[str] = None  # max(procedimentos.updated_at) antes da última leitura
+    int_mark: Optional[str] = None   # max(internacoes.updated_at)
+    tomb_mark: int = 0               # max(deleted_rows.id)
+    loaded_at: float = 0.0
+    synced_at: float = 0.0
+    dirty: bool = False
+    vers: Optional[dict] = None      # versões das tabelas (sql/006) antes da última leitura
+    gen: int = 0                     # muda a cada troca de df (ver data_version)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+_SYNCED: dict[tuple, _SyncedDataset] = {}
+_GEN = itertools.count(1)
+_SYNCED_LOCK = threading.Lock()
+
+def _dirty_scope(tags: Optional[frozenset]) -> Optional[tuple[set[int], set[str]]]:
+    """(internações, hospitais) citados nas tags; None se alguma não for qualificada."""
+    if tags is None:
+        return None
+    iids, hosps = set(), set()
+    for t in tags:
+        base, _, rest = t.partition(":")
+        if base == "hospital":
+            if not rest:
+                return None
+            hosps.add(rest)
+        elif base in ("procedimentos", "internacoes"):
+            if not rest.isdigit():
+                return None
+            iids.add(int(rest))
+    return iids, hosps
+
+def _in_scope(flt: ProcFilter, df: pd.DataFrame, iids: set[int], hosps: set[str]) -> bool:
+    if flt.hospital:
+        if flt.hospital in hosps:
+            return True
+    elif any(h not in flt.excluir_hospitais for h in hosps):
+        return True
+    return bool(iids) and not df.empty and bool(df["internacao_id"].isin(iids).any())
+
+@on_invalidate
+def _mark_synced_dirty(tags: Optional[frozenset]):
+    """Suja só as partições com a internação escrita ou do hospital:<nome> citado."""
+    if tags is not None and not tags_hit(("procedimentos", "internacoes", "hospital"), tags):
+        return
+    scope = _dirty_scope(tags)
+    for (_, flt), ds in list(_SYNCED.items()):
+        if scope is None or _in_scope(flt, ds.df, *scope):
+            ds.dirty = True
 
+@st.cache_resource(show_spinner=False)
+def delta_sync_available() -> bool:
+    """updated_at e deleted_rows existem? Sem isso, recarga completa a cada TTL."""
     try:
-        res_p = sb().table("procedimentos").select(
-            "id, internacao_id, data_procedimento, procedimento, profissional, situacao, aviso, grau_participacao"
-        ).execute()
-        df_p = pd.DataFrame(res_p.data or [])
-        if df_p.empty:
-            return pd.DataFrame()
-
-        ids = sorted(set(int(x) for x in df_p["internacao_id"].dropna().tolist()))
-        res_i = sb().table("internacoes").select("id, atendimento, paciente, hospital, convenio, data_internacao").in_("id", ids).execute() if ids else None
-        df_i = pd.DataFrame(res_i.data or []) if res_i else pd.DataFrame()
-
-        return safe_merge(
-            df_p,
-            df_i[["id","atendimento","paciente","hospital","convenio","data_internacao"]] if not df_i.empty else df_i,
-            left_on="internacao_id",
-            right_on="id",
-            how="left",
-            suffixes=("", "_int"),
+        sb().table("procedimentos").select("updated_at").limit(1).execute()
+        sb().table("internacoes").select("updated_at").limit(1).execute()
+        sb().table("deleted_rows").select("id").limit(1).execute()
+        return True
+    except APIError:
+        return False
+
+@st.cache_resource(show_spinner=False)
+def data_versions_available() -> bool:
+    """Tabela data_versions (sql/006_data_versions.sql) existe?"""
+    try:
+        sb().table("data_versions").select("table_name").limit(1).execute()
+        return True
+    except APIError:
+        return False
+
+def _read_versions() -> Optional[dict[str, int]]:
+    """Fonte de versões do core.cache: uma consulta minúscula."""
+    if not data_versions_available():
+        return None
+    try:
+        rows = sb().table("data_versions").select("table_name, version").execute().data or []
+    except APIError:
+        return None
+    return {r["table_name"]: int(r["version"]) for r in rows}
+
+set_version_source(_read_versions)
+
+def _max_of(table: str, col: str):
+    res = sb().table(table).select(col).order(col, desc=True).limit(1).execute()
+    return (res.data or [{}])[0].get(col)
+
+def _since(mark: str) -> str:
+    return (pd.Timestamp(mark) - DELTA_OVERLAP).isoformat()
+
+def _dataset_cols(view: bool, delta: bool) -> tuple[str, str]:
+    proc_cols, int_cols = PROC_COLS, INT_COLS
+    if typed_dates_available(view):
+        proc_cols, int_cols = f"{proc_cols}, {PROC_DT_COLS}", f"{int_cols}, {INT_DT_COLS}"
+    if delta:
+        proc_cols = f"{proc_cols}, updated_at"
+    return proc_cols, int_cols
+
+def _fetch_full(use_db_view: bool, flt: ProcFilter, delta: bool) -> tuple[pd.DataFrame, dict]:
+    """Carga completa do banco + marcas do delta (lidas ANTES: o que mudar durante entra no próximo)."""
+    marks = {}
+    if delta:
+        marks = {
+            "proc_mark": _max_of("procedimentos", "updated_at"),
+            "int_mark": _max_of("internacoes", "updated_at"),
+            "tomb_mark": int(_max_of("deleted_rows", "id") or 0),
+        }
+    view = use_db_view and db_view_available()
+    proc_cols, int_cols = _dataset_cols(view, delta)
+    df, stats = fetch_proc_join(proc_cols, int_cols, flt, use_db_view=use_db_view)
+    df = _with_stats(df, stats, "Procedimentos")
+    if not flt.is_empty and not df.empty:
+        df = df[flt.mask(df)].reset_index(drop=True)
+    return apply_schema(df), marks
+
+def _disk_key(use_db_view: bool, flt: ProcFilter, delta: bool) -> tuple:
+    view = use_db_view and db_view_available()
+    return (view, flt, _dataset_cols(view, delta))
+
+def _disk_version(vers: Optional[dict]) -> str:
+    """Versões das tabelas (sql/006); sem elas, janela de TTL."""
+    if vers:
+        return "v" + "-".join(f"{vers.get(t, 0)}" for t in DATASET_TABLES)
+    return f"t{int(time.time() // TTL_MED)}"
+
+def _same_rows(old: pd.DataFrame, new: pd.DataFrame, ids=None) -> bool:
+    """
+    `new` tem o mesmo conteúdo de `old`? Ambos ordenados por id; com `ids`,
+    só essas linhas podem diferir (o resto veio de `old`) e só elas são comparadas.
+    """
+    if len(old) != len(new) or list(old.columns) != list(new.columns):
+        return False
+    if ids is None:
+        return old.equals(new)
+    a = old[old["id"].isin(ids)].astype(object).reset_index(drop=True)
+    b = new[new["id"].isin(ids)].astype(object).reset_index(drop=True)
+    return a.equals(b)
+
+def _set_frame(ds: _SyncedDataset, df: pd.DataFrame, ids=None) -> None:
+    """Troca o frame só se o conteúdo mudou: data_version, "Todos" e índices de data seguem valendo."""
+    if ds.loaded_at and _same_rows(ds.df, df, ids):
+        return
+    ds.df = df
+    ds.gen = next(_GEN)
+
+def _load_full(ds: _SyncedDataset, use_db_view: bool, flt: ProcFilter, fresh: bool = False) -> None:
+    """
+    `fresh`: recarga pedida por escrita deste processo. Vai direto ao banco:
+    a versão à mão (janela de TTL, ou versões lidas há até VERSION_POLL s)
+    ainda aponta para o arquivo em disco de antes da escrita.
+    """
+    vers = versions_of(DATASET_TABLES, table_versions())
+    view = use_db_view and db_view_available()
+    ds.delta = not view and delta_sync_available()
+    if fresh:
+        df, marks = _fetch_full(use_db_view, flt, ds.delta)
+    else:
+        df, marks = diskcache.load_or_build(
+            "procedimentos", _disk_key(use_db_view, flt, ds.delta), _disk_version(vers),
+            lambda: _fetch_full(use_db_view, flt, ds.delta),
         )
+    ds.proc_mark, ds.int_mark = marks.get("proc_mark"), marks.get("int_mark")
+    ds.tomb_mark = int(marks.get("tomb_mark") or 0)
+    _set_frame(ds, apply_schema(df))  # arquivos gravados por versões sem schema
+    ds.vers = vers
+    ds.loaded_at = ds.synced_at = time.monotonic()
+
+def _apply_delta(ds: _SyncedDataset, flt: ProcFilter) -> None:
+    vers = versions_of(DATASET_TABLES, table_versions())
+    proc_mark = _max_of("procedimentos", "updated_at")
+    int_mark = _max_of("internacoes", "updated_at")
+    tomb_mark = int(_max_of("deleted_rows", "id") or 0)
+    proc_cols, int_cols = _dataset_cols(False, True)
+
+    # Só o hospital da partição vai ao servidor: uma linha que saiu do resto
+    # do recorte (ex.: mudou de situação) também precisa ser vista para sair.
+    # Quem muda de hospital muda pela internação: as linhas das internações
+    # alteradas saem todas e voltam só as que ainda são da partição.
+    part = ProcFilter(hospital=flt.hospital, excluir_hospitais=flt.excluir_hospitais)
+    parts = []
+    since = _since(ds.proc_mark) if ds.proc_mark else None
+    chg, _ = fetch_proc_join(proc_cols, int_cols, part,
+                             extra=(lambda q: q.gte("updated_at", since)) if since else None)
+    parts.append(chg)
+
+    int_ids = []
+    if ds.int_mark:
+        int_since = _since(ds.int_mark)
+        int_ids = [int(r["id"]) for r in
+                   fetch_all("internacoes", "id", filters=lambda q: q.gte("updated_at", int_since))]
+        for i in range(0, len(int_ids), INT_CHUNK):
+            ids = int_ids[i:i + INT_CHUNK]
+            more, _ = fetch_proc_join(proc_cols, int_cols, part, extra=lambda q, ids=ids: q.in_("internacao_id", ids))
+            parts.append(more)
+
+    tomb_from = ds.tomb_mark
+    tombs = fetch_all("deleted_rows", "id, table_name, row_id", filters=lambda q: q.gt("id", tomb_from))
+    del_procs = {int(t["row_id"]) for t in tombs if t["table_name"] == "procedimentos"}
+    del_ints = {int(t["row_id"]) for t in tombs if t["table_name"] == "internacoes"}
+
+    parts = [p for p in parts if not p.empty]
+    changed = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+    df = ds.df
+    touched = set(changed["id"]) if not changed.empty else set()
+    if not df.empty:
+        drop = df["id"].isin(del_procs) | df["internacao_id"].isin(del_ints | set(int_ids))
+        if not changed.empty:
+            drop |= df["id"].isin(changed["id"])
+        touched |= set(df.loc[drop, "id"])
+        df = df[~drop]
+    if not changed.empty:
+        changed = changed.drop_duplicates("id", keep="last")
+        changed = changed[~changed["id"].isin(del_procs) & ~changed["internacao_id"].isin(del_ints)]
+        if not flt.is_empty:
+            changed = changed[flt.mask(changed)]
+        df = pd.concat([df, changed], ignore_index=True) if not df.empty else changed
+    # A janela DELTA_OVERLAP relê linhas já aplicadas: sem mudança real, o frame fica.
+    if touched:
+        _set_frame(ds, apply_schema(df.sort_values("id", kind="stable", ignore_index=True)) if not df.empty else df,
+                   touched)
+
+    ds.proc_mark = proc_mark or ds.proc_mark
+    ds.int_mark = int_mark or ds.int_mark
+    ds.tomb_mark = max([ds.tomb_mark, tomb_mark] + [int(t["id"]) for t in tombs])
+    ds.vers = vers
+    ds.synced_at = time.monotonic()
+    if vers:  # processos que ainda não têm o dataset partem desta versão
+        diskcache.store("procedimentos", _disk_key(False, flt, True), _disk_version(vers), ds.df,
+                        {"proc_mark": ds.proc_mark, "int_mark": ds.int_mark, "tomb_mark": ds.tomb_mark})
+
+def _synced_entry(key: tuple) -> _SyncedDataset:
+    with _SYNCED_LOCK:
+        ds = _SYNCED.get(key)
+        if ds is None:
+            if len(_SYNCED) >= MAX_SYNCED:
+                oldest = min(_SYNCED, key=lambda k: _SYNCED[k].synced_at)
+                _SYNCED.pop(oldest, None)
+            ds = _SYNCED[key] = _SyncedDataset()
+        return ds
+
+def _is_stale(ds: _SyncedDataset) -> bool:
+    """Com versões: mudou alguma tabela; sem elas: passou do TTL."""
+    age = time.monotonic() - ds.synced_at
+    same = versions_current(ds.vers)
+    if same is not None:
+        return not same or age > VERSIONED_MAX_AGE
+    return age > TTL_MED
+
+def _refresh(ds: _SyncedDataset, use_db_view: bool, flt: ProcFilter) -> None:
+    """Carga/atualização conforme o estado; chamar com ds.lock adquirido."""
+    now = time.monotonic()
+    # Limpa antes de buscar: escrita durante a busca suja de novo e não se perde.
+    dirty, ds.dirty = ds.dirty, False
+    try:
+        if not ds.loaded_at:
+            _load_full(ds, use_db_view, flt)
+        elif dirty or _is_stale(ds):
+            if ds.delta and now - ds.loaded_at < FULL_RESYNC:
+                _apply_delta(ds, flt)
+            else:
+                _load_full(ds, use_db_view, flt, fresh=dirty)
     except APIError as e:
-        sb_debug_error(e, "Falha ao carregar dados para a Home.")
-        return pd.DataFrame()
+        ds.dirty = ds.dirty or dirty
+        sb_debug_error(e, "Falha ao carregar procedimentos.")
 
-@st.cache_data(ttl=TTL_MED, show_spinner=False)
-def rel_cirurgias_base_df(use_db_view: bool = False) -> pd.DataFrame:
-    if use_db_view:
-        try:
-            res = sb().table("vw_procedimentos_internacoes").select(
-                "procedimento_id, internacao_id, data_procedimento, aviso, profissional, procedimento, grau_participacao, situacao, "
-                "hospital, atendimento, paciente, convenio"
-            ).in_("procedimento", ["Cirurgia / Procedimento", "Parecer"]).execute()
-            df = pd.DataFrame(res.data or [])
-            if "procedimento_id" in df.columns and "id" not in df.columns:
-                df = df.rename(columns={"procedimento_id": "id"})
+def _refresh_and_release(ds: _SyncedDataset, use_db_view: bool, flt: ProcFilter) -> None:
+    try:
+        _refresh(ds, use_db_view, flt)
+    finally:
+        ds.lock.release()
+
+def _partition_frame(use_db_view: bool, flt: ProcFilter) -> pd.DataFrame:
+    """
+    Partição (um hospital, ou o resto) sincronizada. Atualização incremental
+    quando o banco tem updated_at/deleted_rows; senão, recarga completa a
+    cada TTL. Com sql/006 vale até a versão das tabelas mudar; sem ele,
+    vencida há menos de MAX_STALE (e sem escrita pendente) devolve a atual
+    e atualiza em segundo plano. Acessos simultâneos esperam uma carga só.
+    """
+    ds = _synced_entry((bool(use_db_view), flt))
+    if ds.loaded_at and not ds.dirty:
+        if not _is_stale(ds):
+            return ds.df
+        if versions_current(ds.vers) is None and time.monotonic() - ds.synced_at <= TTL_MED + MAX_STALE:
+            if ds.lock.acquire(blocking=False):
+                refresh_in_background(lambda: _refresh_and_release(ds, use_db_view, flt))
+            return ds.df
+    with ds.lock:
+        _refresh(ds, use_db_view, flt)
+        return ds.df
+
+def _partitions(flt: ProcFilter) -> list[ProcFilter]:
+    """Um recorte por hospital cadastrado (ativo ou não) + o resto."""
+    if flt.hospital or flt.excluir_hospitais:
+        return [flt]
+    names = tuple(get_hospitais(include_inactive=True))
+    return [replace(flt, hospital=h) for h in names] + [replace(flt, excluir_hospitais=names)]
+
+# "Todos" montado: refeito só quando alguma partição trocou de frame.
+_ASSEMBLED: dict[tuple, tuple[tuple, pd.DataFrame]] = {}
+
+def _base_frame(use_db_view: bool, flt: ProcFilter) -> pd.DataFrame:
+    """Frame em cache (não alterar): partição do hospital ou "Todos" montado."""
+    parts = _partitions(flt)
+    frames = tuple(_partition_frame(use_db_view, p) for p in parts)
+    if len(frames) == 1:
+        return frames[0]
+    key = (bool(use_db_view), flt)
+    hit = _ASSEMBLED.get(key)
+    if hit is None or len(hit[0]) != len(frames) or any(a is not b for a, b in zip(hit[0], frames)):
+        full = [f for f in frames if not f.empty]
+        out = apply_schema(pd.concat(full, ignore_index=True).sort_values("id", kind="stable", ignore_index=True)) if full else pd.DataFrame()
+        if key not in _ASSEMBLED and len(_ASSEMBLED) >= MAX_ASSEMBLED:
+            _ASSEMBLED.pop(next(iter(_ASSEMBLED)), None)
+        _ASSEMBLED[key] = hit = (frames, out)
+    return hit[1]
+
+def data_version(use_db_view: bool = False, flt: Optional[ProcFilter] = None) -> tuple:
+    """Versão (local ao processo) das partições por trás das projeções de `flt`."""
+    hosp = ProcFilter(hospital=(flt or ProcFilter()).hospital)
+    return tuple(_synced_entry((bool(use_db_view), p)).gen for p in _partitions(hosp))
+
+def procedimentos_base_df(use_db_view: bool = False, flt: ProcFilter = ProcFilter()) -> pd.DataFrame:
+    """
+    Dataset procedimentos ⨝ internações, com as colunas de todas as abas.
+    Com hospital, só a partição dele; sem, a junção de todas. Demais campos
+    de `flt` são baixados já filtrados (cada filtro é um conjunto próprio).
+    """
+    return _base_frame(use_db_view, flt).copy(deep=False)
+
+# ---- Write-through ----
+# Escritas de procedimentos remendam as linhas nos datasets e no cache de
+# get_procedimentos com o que o banco devolveu (read-your-writes sem nova
+# leitura). Sem como remendar (linha nova de internação fora do cache),
+# o dataset fica sujo e o delta resolve na próxima leitura.
+
+def _int_fields(internacao_id) -> Optional[dict]:
+    """Colunas da internação: de algum dataset em memória ou, na falta, do banco."""
+    for ds in list(_SYNCED.values()):
+        df = ds.df
+        if df.empty or "internacao_id" not in df.columns:
+            continue
+        hit = df[df["internacao_id"] == internacao_id]
+        if not hit.empty:
+            row = hit.iloc[0]
+            cols = [c for c in df.columns if c in _INT_FIELD_COLS]
+            return {c: row[c] for c in cols}
+    _, int_cols = _dataset_cols(False, False)
+    try:
+        res = sb().table("internacoes").select(int_cols).eq("id", int(internacao_id)).limit(1).execute()
+    except APIError:
+        return None
+    return (res.data or [None])[0]
+
+_INT_FIELD_COLS = {c.strip() for c in f"{INT_COLS}, {INT_DT_COLS}".split(",")}
+
+def _patch_frame(df: pd.DataFrame, rows: list[dict], flt: Optional[ProcFilter] = None,
+                 int_fields: Optional[Callable] = None) -> Optional[pd.DataFrame]:
+    """`df` com `rows` aplicadas por id (o próprio `df` se nada o atinge); None se uma linha nova não puder ser montada."""
+    ids = [int(r["id"]) for r in rows]
+    old = df.set_index("id", drop=False) if not df.empty else None
+    present = old is not None and any(i in old.index for i in ids)
+    patched = []
+    for r in rows:
+        rid = int(r["id"])
+        if old is not None and rid in old.index:
+            base = old.loc[rid].to_dict()
+        elif int_fields is not None:
+            base = int_fields(r.get("internacao_id"))
+            if base is None:
+                return None
+        else:
+            base = {}
+        for c in DATE_COLS:  # texto mudou sem a coluna tipada: apply_schema reparseia
+            if c in r and dt_col(c) not in r:
+                base[dt_col(c)] = None
+        patched.append({**base, **{k: v for k, v in r.items() if old is None or k in df.columns}})
+    new = pd.DataFrame(patched, columns=None if old is None else df.columns)
+    if flt is not None and not flt.is_empty:
+        new = new[flt.mask(new)]
+        if new.empty and not present:
             return df
-        except APIError:
-            pass
+    rest = df[~df["id"].isin(ids)] if old is not None else df
+    out = pd.concat([rest, new], ignore_index=True) if not rest.empty else new
+    return out.sort_values("id", kind="stable", ignore_index=True)
+
+def _write_through(rows: Optional[list[dict]], *tags: str) -> None:
+    """Aplica as linhas devolvidas pela escrita; o resto de `tags` é invalidado."""
+    if not rows or any(r.get("id") is None or r.get("internacao_id") is None for r in rows):
+        invalidate(*tags)
+        return
+    known: dict = {}  # uma busca por internação, não uma por partição
+    int_fields = lambda iid: known[iid] if iid in known else known.setdefault(iid, _int_fields(iid))
+    for (_, flt), ds in list(_SYNCED.items()):
+        with ds.lock:
+            if not ds.loaded_at:
+                continue
+            out = _patch_frame(ds.df, rows, flt, int_fields)
+            if out is None:
+                ds.dirty = True
+                continue
+            if out is not ds.df:
+                ds.df = apply_schema(out)
+                ds.gen = next(_GEN)
+            # Um comando: versão esperada +1, também nas partições que a escrita não toca.
+            if ds.vers and "procedimentos" in ds.vers:
+                ds.vers = {**ds.vers, "procedimentos": ds.vers["procedimentos"] + 1}
+    for iid in {int(r["internacao_id"]) for r in rows}:
+        mine = [r for r in rows if int(r["internacao_id"]) == iid]
+        get_procedimentos.patch(lambda df, mine=mine: _patch_frame(df, mine), iid)
+    invalidate(*tags, keep=(get_procedimentos, _mark_synced_dirty))
+
+def _project(df: pd.DataFrame, cols: list[str], flt: Optional[ProcFilter] = None) -> pd.DataFrame:
+    """Recorte local (linhas/colunas) do dataset."""
+    if df.empty:
+        return pd.DataFrame()
+    out = df if flt is None or flt.is_empty else df[flt.mask(df, indexed=True)]
+    out = out[[c for c in cols if c in out.columns]].reset_index(drop=True)
+    # Texto faltante volta a None, como vinha do banco: no dtype str do pandas
+    # é NaN, que passa por `x or None` e quebra o JSON das gravações.
+    for c in out.columns:
+        s = out[c]
+        if (s.dtype == object or isinstance(s.dtype, pd.StringDtype)) and s.hasnans:
+            out[c] = s.astype(object).where(s.notna(), None)
+    return out
+
+def _dataset_for(use_db_view: bool, flt: Optional[ProcFilter], base: ProcFilter) -> tuple[pd.DataFrame, Optional[ProcFilter]]:
+    """
+    Partição compartilhada do hospital (ou "Todos") + recorte local: o filtro
+    do usuário restrito por `base`. Períodos saem dos índices de data do
+    frame em cache (searchsorted), sem nova busca a cada mudança de datas.
+    """
+    flt = (flt or ProcFilter()).restrict(
+        situacoes=base.situacoes, procedimentos=base.procedimentos, quitado=base.quitado,
+    )
+    return _base_frame(use_db_view, ProcFilter(hospital=flt.hospital)), replace(flt, hospital=None)
+
+HOME_COLS = [
+    "id", "internacao_id", "data_procedimento", "procedimento", "profissional", "situacao", "aviso",
+    "grau_participacao", "atendimento", "paciente", "hospital", "convenio", "data_internacao",
+]
+REL_CIRURGIAS_COLS = [
+    "id", "internacao_id", "data_procedimento", "aviso", "profissional", "procedimento",
+    "grau_participacao", "situacao", "hospital", "atendimento", "paciente", "convenio",
+]
+REL_QUITACOES_COLS = [
+    "id", "internacao_id", "data_procedimento", "profissional", "grau_participacao", "situacao",
+    "quitacao_data", "quitacao_guia_amhptiss", "quitacao_guia_complemento",
+    "quitacao_valor_amhptiss", "quitacao_valor_complemento",
+    "hospital", "atendimento", "paciente", "convenio",
+]
+QUITACAO_PENDENTES_COLS = [
+    "id", "internacao_id", "data_procedimento", "profissional", "aviso", "situacao", "procedimento",
+    "quitacao_data", "quitacao_guia_amhptiss", "quitacao_valor_amhptiss",
+    "quitacao_guia_complemento", "quitacao_valor_complemento", "quitacao_observacao",
+    "hospital", "atendimento", "paciente", "convenio",
+]
+
+def home_fetch_base_df(use_db_view: bool = False, flt: Optional[ProcFilter] = None) -> pd.DataFrame:
+    """Base Procedimentos + Internações para Home."""
+    df, local = _dataset_for(use_db_view, flt, ProcFilter())
+    return _project(df, HOME_COLS, local)
 
+def rel_cirurgias_base_df(use_db_view: bool = False, flt: Optional[ProcFilter] = None) -> pd.DataFrame:
+    df, local = _dataset_for(use_db_view, flt, ProcFilter(procedimentos=tuple(TIPOS_CIRURGIA)))
+    return _project(df, REL_CIRURGIAS_COLS, local)
+
+def rel_quitacoes_base_df(use_db_view: bool = False, flt: Optional[ProcFilter] = None) -> pd.DataFrame:
+    df, local = _dataset_for(use_db_view, flt, ProcFilter(procedimentos=("Cirurgia / Procedimento",), quitado=True))
+    return _project(df, REL_QUITACOES_COLS, local)
+
+def quitacao_pendentes_base_df(use_db_view: bool = False, flt: Optional[ProcFilter] = None) -> pd.DataFrame:
+    df, local = _dataset_for(use_db_view, flt, ProcFilter(
+        procedimentos=tuple(TIPOS_CIRURGIA), situacoes=("Enviado para pagamento",),
+    ))
+    return _project(df, QUITACAO_PENDENTES_COLS, local)
+
+# ---- Importação no servidor (sql/007_import_tiss.sql) ----
+IMPORT_RPC = "import_tiss"
+IMPORT_FIELDS = ("atendimento", "data", "profissional", "paciente", "convenio", "aviso")
+
+@st.cache_resource(show_spinner=False)
+def import_rpc_available() -> bool:
+    """Sonda única por processo. Lista vazia: import_tiss responde antes do lock, sem INSERT."""
+    try:
+        sb().rpc(IMPORT_RPC, {"p_hospital": "", "p_registros": []}).execute()
+        return True
+    except APIError:
+        return False
+
+def importar_tiss(hospital: str, registros: list[dict]) -> Optional[dict]:
+    """
+    Internações faltantes + procedimentos automáticos numa chamada só,
+    idempotente (reimportar não duplica). Devolve as contagens; None se falhar.
+    """
+    payload = [{k: r.get(k) or "" for k in IMPORT_FIELDS} for r in registros]
     try:
-        resp = sb().table("procedimentos").select(
-            "internacao_id, data_procedimento, aviso, profissional, procedimento, grau_participacao, situacao"
-        ).in_("procedimento", ["Cirurgia / Procedimento", "Parecer"]).execute()
-        dfp = pd.DataFrame(resp.data or [])
-        if dfp.empty:
-            return pd.DataFrame()
-        ids = sorted(set(int(x) for x in dfp["internacao_id"].dropna().tolist()))
-        resi = sb().table("internacoes").select("id, hospital, atendimento, paciente, convenio").in_("id", ids).execute() if ids else None
-        dfi = pd.DataFrame(resi.data or []) if resi else pd.DataFrame()
-        return safe_merge(dfp, dfi, left_on="internacao_id", right_on="id", how="left")
+        res = sb().rpc(IMPORT_RPC, {"p_hospital": hospital, "p_registros": payload}).execute()
     except APIError as e:
-        sb_debug_error(e, "Falha ao carregar dados para Relatório.")
-        return pd.DataFrame()
+        sb_debug_error(e, "Falha ao importar no servidor.")
+        return None
+    out = res.data or {}
+    invalidate(
+        f"hospital:{hospital}", "profissionais",
+        *(f"atendimento:{int(k)}" for k in out.get("atendimento_keys") or []),
+        *(f"procedimentos:{int(i)}" for i in out.get("internacao_ids") or []),
+    )
+    return out
 
-@st.cache_data(ttl=TTL_MED, show_spinner=False)
-def rel_quitacoes_base_df(use_db_view: bool = False) -> pd.DataFrame:
-    if use_db_view:
-        try:
-            res = sb().table("vw_procedimentos_internacoes").select(
-                "procedimento_id, internacao_id, data_procedimento, profissional, grau_participacao, situacao, "
-                "quitacao_data, quitacao_guia_amhptiss, quitacao_guia_complemento, "
-                "quitacao_valor_amhptiss, quitacao_valor_complemento, "
-                "hospital, atendimento, paciente, convenio"
-            ).not_.is_("quitacao_data", None).eq("procedimento", "Cirurgia / Procedimento").execute()
-            df = pd.DataFrame(res.data or [])
-            if "procedimento_id" in df.columns and "id" not in df.columns:
-                df = df.rename(columns={"procedimento_id": "id"})
-            return df
-        except APIError:
-            pass
+# ---- Registro de importações (sql/008_import_ledger.sql) ----
+LEDGER_TABLE = "import_ledger"
 
+@st.cache_resource(show_spinner=False)
+def import_ledger_available() -> bool:
+    """Tabela import_ledger (sql/008_import_ledger.sql) existe?"""
     try:
-        resp = sb().table("procedimentos").select(
-            "internacao_id, data_procedimento, profissional, grau_participacao, situacao, "
-            "quitacao_data, quitacao_guia_amhptiss, quitacao_guia_complemento, "
-            "quitacao_valor_amhptiss, quitacao_valor_complemento"
-        ).eq("procedimento", "Cirurgia / Procedimento").not_.is_("quitacao_data", None).execute()
-        dfp = pd.DataFrame(resp.data or [])
-        if dfp.empty:
-            return pd.DataFrame()
-        ids = sorted(set(int(x) for x in dfp["internacao_id"].dropna().tolist()))
-        resi = sb().table("internacoes").select("id, hospital, atendimento, paciente, convenio").in_("id", ids).execute() if ids else None
-        dfi = pd.DataFrame(resi.data or []) if resi else pd.DataFrame()
-        return safe_merge(dfp, dfi, left_on="internacao_id", right_on="id", how="left")
+        sb().table(LEDGER_TABLE).select("sha256").limit(1).execute()
+        return True
+    except APIError:
+        return False
+
+def ledger_get(sha256: str, escopo: str) -> Optional[dict]:
+    """Importação registrada deste arquivo/escopo; None se não houver (ou sem tabela)."""
+    if not import_ledger_available():
+        return None
+    try:
+        rows = (sb().table(LEDGER_TABLE).select("*")
+                .eq("sha256", sha256).eq("escopo", escopo).limit(1).execute().data or [])
+        return rows[0] if rows else None
     except APIError as e:
-        sb_debug_error(e, "Falha ao carregar dados de quitações.")
-        return pd.DataFrame()
+        sb_debug_error(e, "Falha ao ler o registro de importações.")
+        return None
 
-@st.cache_data(ttl=TTL_MED, show_spinner=False)
-def quitacao_pendentes_base_df(use_db_view: bool = False) -> pd.DataFrame:
-    tipos = ["Cirurgia / Procedimento", "Parecer"]
-    if use_db_view:
+def ledger_checkpoint(sha256: str, escopo: str, hospital: str, arquivo: str,
+                      total_blocos: int, blocos_feitos: int, resultado: dict) -> bool:
+    """Marca os blocos já gravados (upsert); concluído quando feitos == total."""
+    if not import_ledger_available():
+        return False
+    try:
+        sb().table(LEDGER_TABLE).upsert({
+            "sha256": sha256,
+            "escopo": escopo,
+            "hospital": hospital,
+            "arquivo": arquivo or "",
+            "total_blocos": int(total_blocos),
+            "blocos_feitos": int(blocos_feitos),
+            "concluido": blocos_feitos >= total_blocos,
+            "resultado": resultado,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }, on_conflict="sha256,escopo").execute()
+        return True
+    except APIError as e:
+        sb_debug_error(e, "Falha ao registrar o progresso da importação.")
+        return False
+
+KPI_RPC = "kpi_status_counts"
+KPI_COLS = ["hospital", "mes", "situacao", "total"]
+
+@st.cache_resource(show_spinner=False)
+def kpi_rpc_available() -> bool:
+    """Sonda única por processo da função de KPIs (sql/001_kpi_status_counts.sql)."""
+    try:
+        sb().rpc(KPI_RPC, {"p_hospital": ""}).execute()
+        return True
+    except APIError:
+        return False
+
+def _iso(d) -> Optional[str]:
+    return d.isoformat() if d else None
+
+def _local_status_counts(flt: ProcFilter, use_db_view: bool) -> pd.DataFrame:
+    """Fallback sem RPC: agrega o dataset compartilhado."""
+    df = _base_frame(use_db_view, ProcFilter(hospital=flt.hospital))
+    if df.empty:
+        return pd.DataFrame(columns=KPI_COLS)
+    sel = df[replace(flt, hospital=None).mask(df, indexed=True)]
+    mes = dates_of(sel, "data_procedimento").apply(lambda d: d.replace(day=1) if pd.notna(d) else None)
+    out = (
+        sel.assign(mes=mes).groupby(["hospital", "mes", "situacao"], dropna=False, observed=True)
+        .size().reset_index(name="total")
+    )
+    return out[KPI_COLS]
+
+def _rpc_supports(flt: ProcFilter) -> bool:
+    """A função SQL só conhece hospital e os intervalos de internação/procedimento."""
+    return flt == ProcFilter(hospital=flt.hospital, int_range=flt.int_range, proc_range=flt.proc_range)
+
+@cached(ttl=TTL_SHORT, tags=("procedimentos", "internacoes"))
+def status_counts(flt: ProcFilter = ProcFilter(), use_db_view: bool = False) -> pd.DataFrame:
+    """
+    Contagens hospital × mês (do procedimento) × situação para o recorte `flt`.
+    Agrega no Postgres via RPC; sem a função instalada (ou com filtros que ela
+    não conhece), agrega localmente o dataset compartilhado.
+    """
+    if kpi_rpc_available() and _rpc_supports(flt):
+        int_range, proc_range = flt.int_range, flt.proc_range
         try:
-            res = sb().table("vw_procedimentos_internacoes").select(
-                "procedimento_id, internacao_id, data_procedimento, profissional, aviso, situacao, procedimento, "
-                "quitacao_data, quitacao_guia_amhptiss, quitacao_valor_amhptiss, "
-                "quitacao_guia_complemento, quitacao_valor_complemento, quitacao_observacao, "
-                "hospital, atendimento, paciente, convenio"
-            ).in_("procedimento", tipos).eq("situacao", "Enviado para pagamento").execute()
-            df = pd.DataFrame(res.data or [])
-            if "procedimento_id" in df.columns and "id" not in df.columns:
-                df = df.rename(columns={"procedimento_id": "id"})
+            res = sb().rpc(KPI_RPC, {
+                "p_hospital": flt.hospital,
+                "p_int_ini": _iso(int_range and int_range[0]),
+                "p_int_fim": _iso(int_range and int_range[1]),
+                "p_proc_ini": _iso(proc_range and proc_range[0]),
+                "p_proc_fim": _iso(proc_range and proc_range[1]),
+            }).execute()
+            df = pd.DataFrame(res.data or [], columns=KPI_COLS)
+            df["mes"] = pd.to_datetime(df["mes"], errors="coerce").dt.date
             return df
-        except APIError:
-            pass
+        except APIError as e:
+            sb_debug_error(e, "Falha ao agregar KPIs.")
+            return pd.DataFrame(columns=KPI_COLS)
+    return _local_status_counts(flt, use_db_view)
 
-    try:
-        resp = sb().table("procedimentos").select(
-            "id, internacao_id, data_procedimento, profissional, aviso, situacao, procedimento, "
-            "quitacao_data, quitacao_guia_amhptiss, quitacao_valor_amhptiss, "
-            "quitacao_guia_complemento, quitacao_valor_complemento, quitacao_observacao"
-        ).in_("procedimento", tipos).eq("situacao", "Enviado para pagamento").execute()
-        dfp = pd.DataFrame(resp.data or [])
-        if dfp.empty:
-            return pd.DataFrame()
-        ids = sorted(set(int(x) for x in dfp["internacao_id"].dropna().tolist()))
-        resi = sb().table("internacoes").select("id, hospital, atendimento, paciente, convenio").in_("id", ids).execute() if ids else None
-        dfi = pd.DataFrame(resi.data or []) if resi else pd.DataFrame()
-        return safe_merge(dfp, dfi, left_on="internacao_id", right_on="id", how="left", suffixes=("", "_int"))
-    except APIError as e:
-        sb_debug_error(e, "Falha ao carregar pendências de quitação.")
-        return pd.DataFrame()
+def _count_head(situacao: str, flt: ProcFilter, use_db_view: bool) -> int:
+    """count=exact + head=True: só o total no Content-Range, nenhuma linha."""
+    if use_db_view and db_view_available():
+        q = sb().table(VIEW_PROC_INT).select("procedimento_id", count="exact", head=True)
+        q = flt.apply(q, view=True)
+    else:
+        cols = "id, internacoes!inner(hospital)" if flt.needs_internacao else "id"
+        q = flt.apply(sb().table("procedimentos").select(cols, count="exact", head=True))
+    return int(q.eq("situacao", situacao).execute().count or 0)
+
+@cached(ttl=TTL_SHORT, tags=("procedimentos", "internacoes"))
+def status_totals(statuses: tuple[str, ...], flt: ProcFilter = ProcFilter(),
+                  use_db_view: bool = False) -> dict[str, int]:
+    """Total por situação (KPIs da Home) sem baixar as linhas."""
+    no_dates = not (flt.proc_range or flt.int_range or flt.quit_range)
+    if not kpi_rpc_available() and no_dates:
+        try:
+            return {s: _count_head(s, flt, use_db_view) for s in statuses}
+        except APIError as e:
+            sb_debug_error(e, "Falha ao contar procedimentos.")
+            return {s: 0 for s in statuses}
+    df = status_counts(flt, use_db_view)
+    by_status = df.groupby("situacao")["total"].sum() if not df.empty else pd.Series(dtype="int64")
+    return {s: int(by_status.get(s, 0)) for s in statuses}
@@ -0,0 +1,138 @@
+# core/diskcache.py
+# Cache em disco dos datasets, compartilhado pelos processos do mesmo nó.
+# Opcional: só liga com DISK_CACHE_DIR nos secrets, pyarrow e fcntl (POSIX).
+# Um arquivo Arrow IPC por (dataset, chave, versão). O primeiro processo que
+# precisa de uma versão busca no banco sob flock e grava; os demais esperam o
+# lock e leem o mesmo arquivo por memory-map (sem desserializar).
+from __future__ import annotations
+import hashlib
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Callable, Hashable, Iterator, Optional
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+except ImportError:  # opcional
+    pa = ipc = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem flock, sem cache em disco
+    fcntl = None
+
+FORMAT = 2          # muda quando o layout dos arquivos mudar
+META_KEY = b"gh_meta"
+
+_dir: Optional[str] = None
+
+def configure(path: Optional[str]) -> bool:
+    """Liga o cache em `path` (None desliga). Devolve se ficou ligado."""
+    global _dir
+    _dir = None
+    if not path or pa is None or fcntl is None:
+        return False
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError:
+        return False
+    _dir = path
+    return True
+
+def enabled() -> bool:
+    return _dir is not None
+
+def _key_hash(name: str, key: Hashable) -> str:
+    return hashlib.sha1(f"{FORMAT}|{name}|{key!r}".encode()).hexdigest()[:20]
+
+def _path(name: str, key: Hashable, version: str) -> str:
+    return os.path.join(_dir, f"{name}-{_key_hash(name, key)}-{version}.arrow")
+
+@contextmanager
+def _locked(name: str, key: Hashable) -> Iterator[None]:
+    """flock exclusivo por (dataset, chave): uma busca por nó."""
+    lock_path = os.path.join(_dir, f"{name}-{_key_hash(name, key)}.lock")
+    with open(lock_path, "a+") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+def _read(path: str) -> tuple[pd.DataFrame, dict]:
+    src = pa.memory_map(path, "r")  # buffers seguem o mapa; sem cópia para o processo
+    table = ipc.open_file(src).read_all()
+    meta = json.loads((table.schema.metadata or {}).get(META_KEY, b"{}"))
+    return table.to_pandas(split_blocks=True), meta
+
+def _write(path: str, df: pd.DataFrame, meta: dict) -> bool:
+    """Grava em arquivo temporário e renomeia (leitores nunca veem meio arquivo)."""
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError):
+        return False  # coluna com tipos mistos: fica só em memória
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), META_KEY: json.dumps(meta).encode()})
+    fd, tmp = tempfile.mkstemp(dir=_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh, ipc.new_file(fh, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp, path)
+        return True
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        return False
+
+def _prune(name: str, key: Hashable, keep: str) -> None:
+    """Remove versões antigas da mesma chave (quem as mapeou continua lendo)."""
+    prefix = f"{name}-{_key_hash(name, key)}-"
+    for fn in os.listdir(_dir):
+        if fn.startswith(prefix) and fn.endswith(".arrow") and fn != os.path.basename(keep):
+            try:
+                os.unlink(os.path.join(_dir, fn))
+            except OSError:
+                pass
+
+def load(name: str, key: Hashable, version: str) -> Optional[tuple[pd.DataFrame, dict]]:
+    """Dataset desta versão, se algum processo já gravou."""
+    if not enabled():
+        return None
+    path = _path(name, key, version)
+    try:
+        return _read(path) if os.path.exists(path) else None
+    except (OSError, pa.ArrowInvalid):
+        return None
+
+def store(name: str, key: Hashable, version: str, df: pd.DataFrame, meta: dict) -> bool:
+    """Grava a versão se ainda não existir (ex.: após um delta, para os demais)."""
+    if not enabled():
+        return False
+    path = _path(name, key, version)
+    if os.path.exists(path):
+        return True
+    if _write(path, df, meta):
+        _prune(name, key, path)
+        return True
+    return False
+
+def load_or_build(name: str, key: Hashable, version: str,
+                  build: Callable[[], tuple[pd.DataFrame, dict]]) -> tuple[pd.DataFrame, dict]:
+    """Lê a versão do disco ou, sob lock, constrói uma vez e grava para o nó."""
+    if not enabled():
+        return build()
+    hit = load(name, key, version)
+    if hit is not None:
+        return hit
+    with _locked(name, key):
+        hit = load(name, key, version)  # outro processo pode ter gravado enquanto esperávamos
+        if hit is not None:
+            return hit
+        df, meta = build()
+        store(name, key, version, df, meta)
+        return df, meta
@@ -0,0 +1,176 @@
+# core/filters.py
+from __future__ import annotations
+import weakref
+from dataclasses import dataclass, fields, replace
+from datetime import date, timedelta
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from postgrest.utils import sanitize_param
+
+from core.utils import pt_date_to_dt
+
+# Sem as colunas date (ou antes do backfill), um intervalo curto vira IN
+# (lista de dias em texto) no servidor; acima disso o recorte fica só local.
+MAX_ENUM_DAYS = 92
+
+DateRange = tuple[date, date]
+
+def _date_keys(rng: DateRange) -> Optional[list[str]]:
+    """Todos os dias do intervalo nos dois formatos aceitos por pt_date_to_dt."""
+    ini, fim = rng
+    days = (fim - ini).days + 1
+    if days <= 0 or days > MAX_ENUM_DAYS:
+        return None
+    out = []
+    for i in range(days):
+        d = ini + timedelta(days=i)
+        out += [d.strftime("%d/%m/%Y"), d.isoformat()]
+    return out
+
+def dt_col(col: str) -> str:
+    """Coluna date (sql/002_datas_iso.sql) que acompanha o campo texto `col`."""
+    return f"{col}_dt"
+
+def dates_of(df: pd.DataFrame, col: str) -> pd.Series:
+    """Datas de `col`: coluna tipada quando houver, texto só onde ela faltar."""
+    tcol = dt_col(col)
+    if tcol not in df.columns:
+        return df[col].apply(pt_date_to_dt)
+    d = pd.to_datetime(df[tcol], errors="coerce").dt.date
+    missing = d.isna() & df[col].notna()
+    if missing.any():
+        d = d.astype(object)
+        d[missing] = df.loc[missing, col].apply(pt_date_to_dt)
+    return d
+
+# Índices de datas por frame (id + weakref): só para frames de vida longa
+# (datasets em cache, tratados como imutáveis). Somem junto com o frame.
+_DATE_INDEXES: dict[int, dict[str, tuple[np.ndarray, np.ndarray]]] = {}
+
+def date_index(df: pd.DataFrame, col: str) -> Optional[tuple[np.ndarray, np.ndarray]]:
+    """(datas ordenadas sem NaT, posições no frame) de <col>_dt; None se não tipada."""
+    tcol = dt_col(col)
+    if tcol not in df.columns or not pd.api.types.is_datetime64_any_dtype(df[tcol]):
+        return None
+    key = id(df)
+    per_frame = _DATE_INDEXES.get(key)
+    if per_frame is None:
+        per_frame = _DATE_INDEXES[key] = {}
+        weakref.finalize(df, _DATE_INDEXES.pop, key, None)
+    hit = per_frame.get(col)
+    if hit is None:
+        v = df[tcol].to_numpy()
+        pos = np.argsort(v, kind="stable")[: int((~np.isnat(v)).sum())]  # NaT ordena no fim
+        hit = per_frame[col] = (v[pos], pos)
+    return hit
+
+def _in_range(df: pd.DataFrame, col: str, rng: DateRange, indexed: bool = False) -> pd.Series:
+    idx = date_index(df, col) if indexed else None
+    if idx is not None:
+        vals, pos = idx
+        lo = np.searchsorted(vals, np.datetime64(rng[0]).astype(vals.dtype), "left")
+        hi = np.searchsorted(vals, np.datetime64(rng[1]).astype(vals.dtype), "right")
+        m = np.zeros(len(df), dtype=bool)
+        m[pos[lo:hi]] = True
+        return pd.Series(m, index=df.index)
+    tcol = dt_col(col)
+    if tcol in df.columns and pd.api.types.is_datetime64_any_dtype(df[tcol]):
+        s = df[tcol]  # dataset tipado (core.crud.apply_schema): comparação vetorizada
+        return s.notna() & (s >= pd.Timestamp(rng[0])) & (s <= pd.Timestamp(rng[1]))
+    dt = dates_of(df, col)
+    return dt.notna() & (dt >= rng[0]) & (dt <= rng[1])
+
+@dataclass(frozen=True)
+class ProcFilter:
+    """
+    Recorte declarativo de procedimentos ⨝ internações.
+    Imutável e hashable: serve de chave no cache (core.cache) e nos memos locais.
+    """
+    hospital: Optional[str] = None
+    situacoes: tuple[str, ...] = ()
+    procedimentos: tuple[str, ...] = ()
+    proc_range: Optional[DateRange] = None
+    int_range: Optional[DateRange] = None
+    quit_range: Optional[DateRange] = None
+    quitado: Optional[bool] = None   # True: quitacao_data preenchida
+    excluir_hospitais: tuple[str, ...] = ()  # partição "resto" (core.crud): fora do cadastro
+
+    @property
+    def is_empty(self) -> bool:
+        return self == ProcFilter()
+
+    @property
+    def needs_internacao(self) -> bool:
+        """Filtra por coluna da internação (exige embed !inner fora da view)."""
+        return bool(self.hospital or self.excluir_hospitais or self.int_range)
+
+    def restrict(self, **fixed) -> "ProcFilter":
+        """Aplica restrições fixas só nos campos que o usuário deixou em branco."""
+        names = {f.name for f in fields(self)}
+        upd = {k: v for k, v in fixed.items() if k in names and getattr(self, k) in (None, ())}
+        return replace(self, **upd) if upd else self
+
+    def apply(self, q, view: bool = False, typed: bool = False):
+        """
+        Compila para filtros PostgREST (view: colunas planas; tabela: internacoes.*).
+        `typed`: períodos viram gte/lte nas colunas date indexadas.
+        """
+        int_col = (lambda c: c) if view else (lambda c: f"internacoes.{c}")
+        if self.hospital:
+            q = q.eq(int_col("hospital"), self.hospital)
+        if self.excluir_hospitais:
+            # NOT IN descartaria hospital NULL, que também é do "resto" (como no mask).
+            nomes = ",".join(sanitize_param(h) for h in self.excluir_hospitais)
+            cond = f"hospital.is.null,hospital.not.in.({nomes})"
+            q = q.or_(cond) if view else q.or_(cond, reference_table="internacoes")
+        if self.situacoes:
+            q = q.in_("situacao", list(self.situacoes))
+        if self.procedimentos:
+            q = q.in_("procedimento", list(self.procedimentos))
+        if self.quitado is True or self.quit_range:
+            q = q.not_.is_("quitacao_data", None)
+        elif self.quitado is False:
+            q = q.is_("quitacao_data", None)
+        for col, rng in (("data_procedimento", self.proc_range),
+                         (int_col("data_internacao"), self.int_range),
+                         ("quitacao_data", self.quit_range)):
+            if not rng:
+                continue
+            if typed:
+                q = q.gte(dt_col(col), rng[0].isoformat()).lte(dt_col(col), rng[1].isoformat())
+                continue
+            keys = _date_keys(rng)
+            if keys:
+                q = q.in_(col, keys)
+        return q
+
+    def mask(self, df: pd.DataFrame, indexed: bool = False) -> pd.Series:
+        """
+        Avaliação local exata do mesmo recorte (linhas do DataFrame).
+        `indexed`: períodos por searchsorted em índices guardados para `df`
+        (use só com frames em cache que não serão alterados).
+        """
+        m = pd.Series(True, index=df.index)
+        if df.empty:
+            return m
+        if self.hospital:
+            m &= df["hospital"] == self.hospital
+        if self.excluir_hospitais:
+            m &= ~df["hospital"].isin(self.excluir_hospitais)
+        if self.situacoes:
+            m &= df["situacao"].isin(self.situacoes)
+        if self.procedimentos:
+            m &= df["procedimento"].isin(self.procedimentos)
+        if self.quitado is True or self.quit_range:
+            m &= df["quitacao_data"].notna()
+        elif self.quitado is False:
+            m &= df["quitacao_data"].isna()
+        if self.proc_range:
+            m &= _in_range(df, "data_procedimento", self.proc_range, indexed)
+        if self.int_range:
+            m &= _in_range(df, "data_internacao", self.int_range, indexed)
+        if self.quit_range:
+            m &= _in_range(df, "quitacao_data", self.quit_range, indexed)
+        return m
@@ -0,0 +1,241 @@
+# core/paging.py
+from __future__ import annotations
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, Optional
+
+from core.context import sb
+
+PAGE_SIZE = 1000
+MIN_PAGE = 250
+MAX_PAGE = 5000
+TARGET_LATENCY = 1.0   # segundos por página; acima disso a página encolhe
+MAX_WORKERS = 4
+SLICES_PER_WORKER = 2  # mais fatias que threads equilibra ids esparsos
+IN_CHUNK = 500         # valores por in_() em fetch_in
+IN_MAX_CHARS = 4000    # orçamento da lista na URL (proxies cortam perto de 8 KB)
+
+@dataclass
+class FetchStats:
+    """Quantas linhas vieram (fetched) x quantas existem no servidor (total)."""
+    fetched: int = 0
+    total: Optional[int] = None
+    pages: int = 0
+
+    @property
+    def complete(self) -> bool:
+        return self.total is None or self.fetched >= self.total
+
+_DONE = object()
+
+def _with_key(cols: str, key: str) -> str:
+    if cols.strip() == "*" or re.search(rf"(^|,)\s*{re.escape(key)}\s*(,|$)", cols):
+        return cols
+    return f"{key}, {cols}"
+
+def _base_query(client, table: str, cols: str, filters: Optional[Callable], count: Optional[str] = None):
+    q = client.table(table).select(cols, count=count)
+    return filters(q) if filters else q
+
+def _key_bounds(client, table: str, cols: str, key: str, filters: Optional[Callable]):
+    """
+    (menor chave, maior chave, total) do conjunto filtrado; None se vazio.
+    `cols` é o select das páginas: filtros em recurso embutido (ex.:
+    internacoes!inner) só valem, e só recortam, com o embed no select.
+    """
+    first = _base_query(client, table, cols, filters, count="exact").order(key).limit(1).execute()
+    if not first.data:
+        return None
+    last = _base_query(client, table, cols, filters).order(key, desc=True).limit(1).execute()
+    lo = first.data[0][key]
+    hi = (last.data or first.data)[0][key]
+    return lo, hi, first.count
+
+def _split(lo, hi, parts: int) -> list[tuple[Any, Any]]:
+    """Fatias disjuntas [a, b] cobrindo [lo, hi]; chave não inteira => uma fatia só."""
+    if parts <= 1 or not isinstance(lo, int) or not isinstance(hi, int) or hi <= lo:
+        return [(lo, hi)]
+    step = max(1, -(-(hi - lo + 1) // parts))
+    out, a = [], lo
+    while a <= hi:
+        b = min(hi, a + step - 1)
+        out.append((a, b))
+        a = b + 1
+    return out
+
+def _next_size(size: int, elapsed: float, got: int) -> int:
+    """Página adaptativa: respeita o teto do servidor e a latência alvo."""
+    if got < size:
+        return max(1, got)
+    if elapsed > TARGET_LATENCY:
+        return max(MIN_PAGE, size // 2)
+    if elapsed < TARGET_LATENCY / 2:
+        return min(MAX_PAGE, size * 2)
+    return size
+
+def _scan_slice(client, table: str, cols: str, key: str, filters: Optional[Callable],
+                lo, hi, page_size: int) -> Iterator[list[dict]]:
+    """Keyset dentro de [lo, hi]: WHERE key > cursor ORDER BY key LIMIT n."""
+    cursor, first, size = lo, True, page_size
+    while True:
+        q = _base_query(client, table, cols, filters)
+        q = q.gte(key, cursor) if first else q.gt(key, cursor)
+        t0 = time.monotonic()
+        chunk = q.lte(key, hi).order(key).limit(size).execute().data or []
+        elapsed = time.monotonic() - t0
+        if not chunk:
+            return
+        last = chunk[-1].get(key)  # antes do yield: o consumidor pode alterar as linhas
+        yield chunk
+        # Só chave inteira compara igual no Python e no banco; texto segue a
+        # collation do servidor (lte(hi) acima), então pagina até vir vazia.
+        if last is None or (isinstance(last, int) and last >= hi):
+            return
+        cursor, first = last, False
+        size = _next_size(size, elapsed, len(chunk))
+
+def iter_keyset(table: str, cols: str = "*", *, key: str = "id",
+                filters: Optional[Callable] = None, client=None,
+                page_size: int = PAGE_SIZE, workers: int = MAX_WORKERS,
+                stats: Optional[FetchStats] = None) -> Iterator[list[dict]]:
+    """
+    Lê `table` inteira (ou o recorte de `filters`) por keyset em `key`.
+    O intervalo de chaves é dividido em fatias disjuntas lidas em paralelo
+    (pool limitado a `workers`); páginas chegam em ordem de conclusão.
+    `filters` recebe a query e devolve a query filtrada.
+    """
+    client = client or sb()
+    stats = stats if stats is not None else FetchStats()
+    cols = _with_key(cols, key)
+
+    bounds = _key_bounds(client, table, cols, key, filters)
+    if bounds is None:
+        stats.total = 0
+        return
+    lo, hi, stats.total = bounds
+
+    n_slices = 1
+    if stats.total and stats.total > page_size:
+        n_slices = min(workers * SLICES_PER_WORKER, -(-stats.total // page_size))
+    slices = _split(lo, hi, n_slices)
+
+    if len(slices) == 1 or workers <= 1:
+        for a, b in slices:
+            for chunk in _scan_slice(client, table, cols, key, filters, a, b, page_size):
+                stats.pages += 1
+                stats.fetched += len(chunk)
+                yield chunk
+        return
+
+    out: queue.Queue = queue.Queue(maxsize=workers * 2)
+    stop = threading.Event()
+
+    def _put(item) -> bool:
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _pump(a, b):
+        try:
+            for chunk in _scan_slice(client, table, cols, key, filters, a, b, page_size):
+                if not _put(chunk):
+                    return
+        except BaseException as e:  # repassa ao consumidor (ex.: APIError)
+            _put(e)
+        finally:
+            _put(_DONE)
+
+    pool = ThreadPoolExecutor(max_workers=min(workers, len(slices)), thread_name_prefix="keyset")
+    try:
+        for a, b in slices:
+            pool.submit(_pump, a, b)
+        pending = len(slices)
+        while pending:
+            item = out.get()
+            if item is _DONE:
+                pending -= 1
+                continue
+            if isinstance(item, BaseException):
+                raise item
+            stats.pages += 1
+            stats.fetched += len(item)
+            yield item
+    finally:
+        stop.set()
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def fetch_all(table: str, cols: str = "*", *, key: str = "id",
+              filters: Optional[Callable] = None, client=None,
+              page_size: int = PAGE_SIZE, workers: int = MAX_WORKERS,
+              stats: Optional[FetchStats] = None) -> list[dict]:
+    """Todas as linhas, ordenadas por `key`."""
+    rows: list[dict] = []
+    for chunk in iter_keyset(table, cols, key=key, filters=filters, client=client,
+                             page_size=page_size, workers=workers, stats=stats):
+        rows.extend(chunk)
+    rows.sort(key=lambda r: r.get(key))
+    return rows
+
+def _in_chunks(values: list, max_items: int = IN_CHUNK, max_chars: int = IN_MAX_CHARS) -> Iterator[list]:
+    """Lotes de `values` que cabem num in_() na URL (por quantidade e tamanho)."""
+    chunk, size = [], 0
+    for v in values:
+        n = len(str(v)) + 3  # aspas + vírgula
+        if chunk and (len(chunk) >= max_items or size + n > max_chars):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(v)
+        size += n
+    if chunk:
+        yield chunk
+
+def _scan_open(client, table: str, cols: str, key: str, filters: Callable, page_size: int) -> list[dict]:
+    """Keyset sem limites conhecidos: pagina até vir uma página vazia."""
+    rows, cursor = [], None
+    while True:
+        q = _base_query(client, table, cols, filters)
+        if cursor is not None:
+            q = q.gt(key, cursor)
+        chunk = q.order(key).limit(page_size).execute().data or []
+        if not chunk:
+            return rows
+        rows.extend(chunk)
+        cursor = chunk[-1].get(key)
+        if cursor is None:
+            return rows
+
+def fetch_in(table: str, cols: str, col: str, values, *, key: str = "id",
+             filters: Optional[Callable] = None, client=None,
+             page_size: int = PAGE_SIZE, workers: int = MAX_WORKERS) -> list[dict]:
+    """
+    Linhas com `col` em `values`, para conjuntos grandes de chaves: lotes de
+    in_() que cabem na URL, lidos em paralelo (pool limitado a `workers`),
+    cada lote paginado por keyset em `key` (nada truncado pelo teto do
+    servidor). Resultado ordenado por `key`.
+    """
+    client = client or sb()
+    cols = _with_key(cols, key)
+    chunks = list(_in_chunks(list(dict.fromkeys(v for v in values if v is not None))))
+    if not chunks:
+        return []
+
+    def _one(chunk: list) -> list[dict]:
+        f = lambda q: (filters(q) if filters else q).in_(col, chunk)
+        return _scan_open(client, table, cols, key, f, page_size)
+
+    if len(chunks) == 1 or workers <= 1:
+        parts = [_one(c) for c in chunks]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(chunks)), thread_name_prefix="fetch_in") as pool:
+            parts = list(pool.map(_one, chunks))
+    rows = [r for part in parts for r in part]
+    rows.sort(key=lambda r: r.get(key))
+    return rows
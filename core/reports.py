@@ -1,7 +1,13 @@
 # core/reports.py
 from __future__ import annotations
+import hashlib
 import io
+import os
+import tempfile
+import threading
+from collections import OrderedDict
 from io import BytesIO
+from typing import Callable, Hashable
 import pandas as pd
 from datetime import date, datetime
 
@@ -94,3 +100,73 @@ def excel_quitacoes_colunas_fixas(df: pd.DataFrame) -> bytes:
         ws.freeze_panes = "A2"
 
     return buf.getvalue()
+
+# ---- Artefatos sob demanda ----
+# Bytes de relatório (XLSX/CSV) gerados só quando o usuário pede e guardados
+# por (tipo, filtro, versão dos dados). Memória limitada por bytes (LRU);
+# arquivos grandes vão para disco temporário, também com limite de quantidade.
+ARTIFACT_MEM_BYTES = 64 * 1024 * 1024
+ARTIFACT_SPILL_BYTES = 4 * 1024 * 1024
+ARTIFACT_MAX_FILES = 16
+
+_ART_LOCK = threading.Lock()
+_ART_MEM: "OrderedDict[Hashable, bytes]" = OrderedDict()
+_ART_DISK: "OrderedDict[Hashable, str]" = OrderedDict()
+_art_dir: str | None = None
+
+def _spill_path(key: Hashable) -> str:
+    global _art_dir
+    if _art_dir is None:
+        _art_dir = tempfile.mkdtemp(prefix="gh_relatorios_")
+    return os.path.join(_art_dir, hashlib.sha1(repr(key).encode()).hexdigest())
+
+def _art_get(key: Hashable) -> bytes | None:
+    with _ART_LOCK:
+        if key in _ART_MEM:
+            _ART_MEM.move_to_end(key)
+            return _ART_MEM[key]
+        path = _ART_DISK.get(key)
+        if path is None:
+            return None
+        _ART_DISK.move_to_end(key)
+    try:
+        with open(path, "rb") as fh:
+            return fh.read()
+    except OSError:
+        with _ART_LOCK:
+            _ART_DISK.pop(key, None)
+        return None
+
+def _art_put(key: Hashable, data: bytes) -> None:
+    if len(data) > ARTIFACT_SPILL_BYTES:
+        path = _spill_path(key)
+        try:
+            with open(path, "wb") as fh:
+                fh.write(data)
+        except OSError:
+            return  # sem disco: só não memoiza
+        with _ART_LOCK:
+            _ART_DISK[key] = path
+            _ART_DISK.move_to_end(key)
+            while len(_ART_DISK) > ARTIFACT_MAX_FILES:
+                _, old = _ART_DISK.popitem(last=False)
+                try:
+                    os.unlink(old)
+                except OSError:
+                    pass
+        return
+    with _ART_LOCK:
+        _ART_MEM[key] = data
+        _ART_MEM.move_to_end(key)
+        total = sum(len(v) for v in _ART_MEM.values())
+        while total > ARTIFACT_MEM_BYTES and len(_ART_MEM) > 1:
+            _, old = _ART_MEM.popitem(last=False)
+            total -= len(old)
+
+def report_artifact(key: Hashable, build: Callable[[], bytes]) -> bytes:
+    """Bytes do relatório `key` = (tipo, filtro, versão dos dados); `build` só na falta."""
+    data = _art_get(key)
+    if data is None:
+        data = build()
+        _art_put(key, data)
+    return data
@@ -27,7 +27,7 @@ def to_ddmmyyyy(value) -> str:
     return d.strftime("%d/%m/%Y") if d else str(value)
 
 def to_float_or_none(v):
-    if v is None or v == "":
+    if v is None or v == "" or (isinstance(v, float) and v != v):  # NaN de coluna float64
         return None
     if isinstance(v, (int, float)):
         return float(v)
@@ -57,6 +57,13 @@ def att_norm(v) -> str:
     s = s.lstrip("0")
     return s if s else "0"
 
+def att_key(v):
+    """Chave canônica inteira (sql/004_atendimento_key.sql); None se não houver dígitos."""
+    s = att_norm(v)
+    if s == "0" or len(s) > 18:
+        return None
+    return int(s)
+
 def att_to_number(v):
     """Compatível com schema atual (float)."""
     s = re.sub(r"\D", "", str(v or ""))
@@ -67,13 +74,19 @@ def att_to_number(v):
     except Exception:
         return None
 
+_INT_STR = re.compile(r"([+-]?)([0-9]+)(?:\.0*)?")
+
 def fmt_id_str(x) -> str:
     """Remove '.0', notação científica; preserva strings não numéricas."""
-    if x is None:
+    if x is None or (isinstance(x, float) and x != x):  # NaN: faltante em coluna str/float
         return ""
     s = str(x).strip()
     if s == "":
         return ""
+    m = _INT_STR.fullmatch(s)
+    if m:  # inteiro em texto: sem passar por float (perde dígitos acima de 2**53)
+        digits = m.group(2).lstrip("0") or "0"
+        return digits if m.group(1) != "-" or digits == "0" else "-" + digits
     try:
         f = float(s)
         if abs(f - int(f)) < 1e-9:
@@ -1 +1,226 @@
+# parser.py
+# Leitura do CSV TISS exportado pelos hospitais, em fluxo: o arquivo é lido
+# em blocos de bytes, codificação e separador são detectados uma vez no
+# primeiro bloco e cada linha vira um registro normalizado assim que chega
+# (memória constante, mesmo em exportações mensais de centenas de MB).
+from __future__ import annotations
+import codecs
+import csv
+import io
+import re
+import time
+import unicodedata
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from typing import BinaryIO, Iterator, Optional, Union
 
+from core.utils import fmt_id_str, pt_date_to_dt
+
+CHUNK_SIZE = 1 << 20          # bytes por leitura
+SNIFF_BYTES = 64 * 1024       # amostra para codificação/separador
+DELIMITERS = ";,\t|"
+HEADER_SCAN_ROWS = 50         # cabeçalho pode vir depois de linhas de título
+
+FIELDS = ("atendimento", "data", "profissional", "paciente", "convenio", "aviso")
+
+# Nomes de coluna aceitos (sem acento, minúsculos, sem "de/do/da"), por
+# campo, em ordem de preferência.
+HEADER_ALIASES = {
+    "atendimento": ("atendimento", "nr atendimento", "numero atendimento", "n atendimento",
+                    "no atendimento", "cod atendimento", "codigo atendimento", "atend"),
+    "data": ("data procedimento", "data realizacao", "data execucao",
+             "data cirurgia", "dt procedimento", "dt realizacao", "data atendimento", "data"),
+    "profissional": ("profissional", "prestador", "nome prestador", "medico", "nome medico",
+                     "executante", "profissional executante", "cirurgiao"),
+    "paciente": ("paciente", "nome paciente", "beneficiario", "nome beneficiario"),
+    "convenio": ("convenio", "nome convenio", "operadora", "plano"),
+    "aviso": ("aviso", "nr aviso", "numero aviso", "aviso cirurgia", "n aviso"),
+}
+
+@dataclass
+class ParseStats:
+    """Bytes lidos, linhas do CSV e registros emitidos; vazão em MB/s."""
+    encoding: str = ""
+    delimiter: str = ""
+    bytes_read: int = 0
+    rows: int = 0
+    records: int = 0
+    seconds: float = 0.0
+
+    @property
+    def mb_per_s(self) -> float:
+        return (self.bytes_read / 1e6) / self.seconds if self.seconds > 0 else 0.0
+
+def _norm_header(s: str) -> str:
+    s = unicodedata.normalize("NFKD", str(s or "")).encode("ascii", "ignore").decode()
+    words = re.sub(r"[^a-z0-9]+", " ", s.lower()).split()
+    return " ".join(w for w in words if w not in ("de", "do", "da"))
+
+def _header_map(row: list[str]) -> Optional[dict[str, int]]:
+    """Campo -> índice da coluna; None se a linha não parece o cabeçalho."""
+    names = [_norm_header(c) for c in row]
+    out = {}
+    for fld, aliases in HEADER_ALIASES.items():
+        for alias in aliases:
+            if alias in names and names.index(alias) not in out.values():
+                out[fld] = names.index(alias)
+                break
+    return out if "atendimento" in out and len(out) >= 3 else None
+
+def _detect_encoding(sample: bytes) -> Optional[str]:
+    """Codificação pela amostra; None se ela é só ASCII (ainda não dá para decidir)."""
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if sample.isascii():
+        return None
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "latin1"
+
+class _Utf8OrLatin1:
+    """
+    Decodificador incremental para amostra só ASCII: UTF-8 estrito até o
+    primeiro byte inválido, daí em diante latin1 (o padrão das exportações
+    legadas). Evita trocar acentos de um latin1 por U+FFFD no meio do arquivo.
+    """
+    def __init__(self, stats: ParseStats):
+        self.stats = stats
+        self.stats.encoding = "utf-8"
+        self._dec = codecs.getincrementaldecoder("utf-8")()
+
+    def decode(self, data: bytes, final: bool = False) -> str:
+        try:
+            return self._dec.decode(data, final)
+        except UnicodeDecodeError:  # latin1 decodifica qualquer byte: troca uma vez só
+            pending, _ = self._dec.getstate()  # bytes incompletos do bloco anterior
+            self._dec = codecs.getincrementaldecoder("latin1")()
+            self.stats.encoding = "latin1"
+            return self._dec.decode(pending + data, final)
+
+def _detect_delimiter(text: str) -> str:
+    lines = [ln for ln in text.splitlines()[:HEADER_SCAN_ROWS] if ln.strip()]
+    try:
+        return csv.Sniffer().sniff("\n".join(lines[:20]), delimiters=DELIMITERS).delimiter
+    except csv.Error:
+        counts = {d: sum(ln.count(d) for ln in lines) for d in DELIMITERS}
+        return max(counts, key=counts.get) if any(counts.values()) else ";"
+
+# Datas e números se repetem muito num arquivo mensal: memo por valor.
+@lru_cache(maxsize=4096)
+def _date(v: str) -> str:
+    s = (v or "").strip().split(" ")[0].split("T")[0]
+    if not s:
+        return ""
+    d = pt_date_to_dt(s)
+    if d is None:
+        try:
+            d = datetime.strptime(s, "%d/%m/%y").date()
+        except ValueError:
+            return ""
+    return d.strftime("%d/%m/%Y")
+
+@lru_cache(maxsize=1 << 16)
+def _id(v: str) -> str:
+    return fmt_id_str(v.strip())
+
+def _text(v: str) -> str:
+    return " ".join(v.split())
+
+_NORMALIZE = {"atendimento": _id, "data": _date, "profissional": _text,
+              "paciente": _text, "convenio": _text, "aviso": _id}
+
+def _record(row: list[str], cols: dict[str, int]) -> Optional[dict]:
+    n = len(row)
+    rec = {f: _NORMALIZE[f](row[cols[f]]) if f in cols and cols[f] < n else "" for f in FIELDS}
+    if not any(c.isdigit() for c in rec["atendimento"]):
+        return None  # linha em branco, total ou rodapé
+    return rec
+
+def _lines(first: str, rest: Iterator[str]) -> Iterator[str]:
+    """
+    Texto em blocos -> linhas com terminador (o csv junta campos com quebra).
+    Só \r, \n e \r\n quebram linha (splitlines quebraria em \x85 do latin1);
+    a última parte de cada bloco espera o próximo (pode ser \r de um \r\n).
+    """
+    carry = first
+    for block in rest:
+        parts = io.StringIO(carry + block, newline="").readlines()
+        carry = parts.pop() if parts and not parts[-1].endswith("\n") else ""
+        yield from parts
+    if carry:
+        yield from io.StringIO(carry, newline="")
+
+def _byte_blocks(stream: BinaryIO, stats: ParseStats) -> Iterator[bytes]:
+    while True:
+        block = stream.read(CHUNK_SIZE)
+        if not block:
+            return
+        stats.bytes_read += len(block)
+        yield block
+
+def iter_tiss_records(source: Union[bytes, str, BinaryIO],
+                      stats: Optional[ParseStats] = None) -> Iterator[dict]:
+    """
+    Registros normalizados (FIELDS) do CSV TISS, um a um. `source`: bytes,
+    texto já decodificado ou arquivo binário (ex.: UploadedFile do Streamlit).
+    `stats` é preenchido durante a leitura (vazão ao final).
+    """
+    stats = stats if stats is not None else ParseStats()
+    t0 = time.perf_counter()
+    if isinstance(source, str):
+        stats.encoding = "str"
+        stats.bytes_read = len(source)
+        stats.delimiter = _detect_delimiter(source[:SNIFF_BYTES])
+        lines = io.StringIO(source, newline="")
+    else:
+        stream = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+        raw = _byte_blocks(stream, stats)
+        head = b""
+        for block in raw:
+            head += block
+            if len(head) >= SNIFF_BYTES:
+                break
+        encoding = _detect_encoding(head[:SNIFF_BYTES])
+        if encoding is None:
+            decoder = _Utf8OrLatin1(stats)
+        else:
+            stats.encoding = encoding
+            decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        first = decoder.decode(head)
+        stats.delimiter = _detect_delimiter(first[:SNIFF_BYTES])
+        lines = _lines(first, _decoded(raw, decoder))
+
+    reader = csv.reader(lines, delimiter=stats.delimiter)
+    cols = header = None
+    try:
+        for row in reader:
+            stats.rows += 1
+            if cols is None:
+                if stats.rows > HEADER_SCAN_ROWS:
+                    return  # sem cabeçalho reconhecível: não é um TISS
+                cols = _header_map(row)
+                header = row if cols else None
+                continue
+            if row == header:
+                continue  # cabeçalho repetido (exportação paginada)
+            rec = _record(row, cols)
+            if rec is not None:
+                stats.records += 1
+                yield rec
+    finally:
+        stats.seconds = time.perf_counter() - t0
+
+def _decoded(raw: Iterator[bytes], decoder) -> Iterator[str]:
+    for block in raw:
+        yield decoder.decode(block)
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+def parse_tiss_original(source: Union[bytes, str, BinaryIO],
+                        stats: Optional[ParseStats] = None) -> list[dict]:
+    """Forma em lista de iter_tiss_records (compatível com a aba Importar)."""
+    return list(iter_tiss_records(source, stats))
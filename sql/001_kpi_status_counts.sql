@@ -0,0 +1,47 @@
+-- sql/001_kpi_status_counts.sql
+-- KPIs da Home agregados no servidor: contagem de procedimentos por
+-- hospital x mês (data do procedimento) x situação, com filtros opcionais.
+-- Chamado por core.crud.status_counts via supabase-py: sb().rpc("kpi_status_counts", {...}).
+
+-- Datas ainda são texto 'dd/mm/yyyy' (legado também aceita 'yyyy-mm-dd');
+-- texto inválido vira NULL em vez de abortar a consulta.
+create or replace function public.pt_date(s text)
+returns date
+language sql
+immutable
+as $$
+  select case
+    when s ~ '^\s*\d{2}/\d{2}/\d{4}\s*$' then to_date(trim(s), 'DD/MM/YYYY')
+    when s ~ '^\s*\d{4}-\d{2}-\d{2}' then to_date(substr(trim(s), 1, 10), 'YYYY-MM-DD')
+    else null
+  end
+$$;
+
+create or replace function public.kpi_status_counts(
+  p_hospital text default null,
+  p_int_ini  date default null,
+  p_int_fim  date default null,
+  p_proc_ini date default null,
+  p_proc_fim date default null
+)
+returns table (hospital text, mes date, situacao text, total bigint)
+language sql
+stable
+as $$
+  select
+    i.hospital,
+    date_trunc('month', public.pt_date(p.data_procedimento))::date as mes,
+    p.situacao,
+    count(*) as total
+  from public.procedimentos p
+  join public.internacoes i on i.id = p.internacao_id
+  where (p_hospital is null or i.hospital = p_hospital)
+    and (p_int_ini  is null or public.pt_date(i.data_internacao)   >= p_int_ini)
+    and (p_int_fim  is null or public.pt_date(i.data_internacao)   <= p_int_fim)
+    and (p_proc_ini is null or public.pt_date(p.data_procedimento) >= p_proc_ini)
+    and (p_proc_fim is null or public.pt_date(p.data_procedimento) <= p_proc_fim)
+  group by 1, 2, 3
+$$;
+
+grant execute on function public.pt_date(text) to anon, authenticated;
+grant execute on function public.kpi_status_counts(text, date, date, date, date) to anon, authenticated;
@@ -0,0 +1,90 @@
+-- sql/002_datas_iso.sql
+-- Colunas date nativas ao lado das datas texto legadas ('dd/mm/yyyy').
+-- Aditivo e seguro em produção: colunas nulas, índices CONCURRENTLY.
+-- Gravações novas já saem com as colunas date (trigger abaixo); para as linhas
+-- antigas, rode o backfill em Sistema > "Migrar datas"
+-- (core.backfill.backfill_datas), que é em lotes e retomável.
+
+alter table public.internacoes   add column if not exists data_internacao_dt   date;
+alter table public.procedimentos add column if not exists data_procedimento_dt date;
+alter table public.procedimentos add column if not exists quitacao_data_dt     date;
+
+-- CONCURRENTLY não roda dentro de transação: execute estas linhas isoladamente.
+create index concurrently if not exists internacoes_data_internacao_dt_idx   on public.internacoes   (data_internacao_dt);
+create index concurrently if not exists procedimentos_data_procedimento_dt_idx on public.procedimentos (data_procedimento_dt);
+create index concurrently if not exists procedimentos_quitacao_data_dt_idx     on public.procedimentos (quitacao_data_dt);
+
+-- pt_date (sql/001) passa a tolerar texto no formato certo mas fora do
+-- calendário (00/00/0000, 31/02/2024): to_date abortaria a consulta ou a
+-- gravação; vira NULL, como qualquer texto inválido.
+create or replace function public.pt_date(s text)
+returns date
+language plpgsql
+immutable
+as $$
+begin
+  return case
+    when s ~ '^\s*\d{2}/\d{2}/\d{4}\s*$' then to_date(trim(s), 'DD/MM/YYYY')
+    when s ~ '^\s*\d{4}-\d{2}-\d{2}' then to_date(substr(trim(s), 1, 10), 'YYYY-MM-DD')
+    else null
+  end;
+exception when others then
+  return null;
+end
+$$;
+
+-- As colunas date acompanham o texto em toda gravação, inclusive de quem não
+-- passa por core.crud.with_typed_dates (restauração de backup, SQL direto).
+create or replace function public.sync_datas_dt()
+returns trigger
+language plpgsql
+as $$
+begin
+  if tg_table_name = 'internacoes' then
+    new.data_internacao_dt := public.pt_date(new.data_internacao);
+  else
+    new.data_procedimento_dt := public.pt_date(new.data_procedimento);
+    new.quitacao_data_dt     := public.pt_date(new.quitacao_data);
+  end if;
+  return new;
+end
+$$;
+
+drop trigger if exists internacoes_sync_datas_dt on public.internacoes;
+create trigger internacoes_sync_datas_dt
+  before insert or update of data_internacao, data_internacao_dt on public.internacoes
+  for each row execute function public.sync_datas_dt();
+
+drop trigger if exists procedimentos_sync_datas_dt on public.procedimentos;
+create trigger procedimentos_sync_datas_dt
+  before insert or update of data_procedimento, data_procedimento_dt, quitacao_data, quitacao_data_dt
+  on public.procedimentos
+  for each row execute function public.sync_datas_dt();
+
+-- KPIs filtram pelas colunas date; linha ainda sem *_dt (backfill em
+-- andamento) cai no texto, então o resultado não depende do backfill.
+create or replace function public.kpi_status_counts(
+  p_hospital text default null,
+  p_int_ini  date default null,
+  p_int_fim  date default null,
+  p_proc_ini date default null,
+  p_proc_fim date default null
+)
+returns table (hospital text, mes date, situacao text, total bigint)
+language sql
+stable
+as $$
+  select
+    i.hospital,
+    date_trunc('month', coalesce(p.data_procedimento_dt, public.pt_date(p.data_procedimento)))::date as mes,
+    p.situacao,
+    count(*) as total
+  from public.procedimentos p
+  join public.internacoes i on i.id = p.internacao_id
+  where (p_hospital is null or i.hospital = p_hospital)
+    and (p_int_ini  is null or coalesce(i.data_internacao_dt,   public.pt_date(i.data_internacao))   >= p_int_ini)
+    and (p_int_fim  is null or coalesce(i.data_internacao_dt,   public.pt_date(i.data_internacao))   <= p_int_fim)
+    and (p_proc_ini is null or coalesce(p.data_procedimento_dt, public.pt_date(p.data_procedimento)) >= p_proc_ini)
+    and (p_proc_fim is null or coalesce(p.data_procedimento_dt, public.pt_date(p.data_procedimento)) <= p_proc_fim)
+  group by 1, 2, 3
+$$;
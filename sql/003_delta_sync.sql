@@ -0,0 +1,65 @@
+-- sql/003_delta_sync.sql
+-- Suporte à sincronização incremental dos datasets em cache (core.crud):
+--   * updated_at em internacoes/procedimentos, mantido por trigger;
+--   * deleted_rows: lápides das exclusões, lidas por id crescente.
+-- O app detecta as colunas/tabela sozinho; sem elas, volta à recarga completa.
+
+alter table public.internacoes   add column if not exists updated_at timestamptz not null default now();
+alter table public.procedimentos add column if not exists updated_at timestamptz not null default now();
+
+create or replace function public.set_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+  new.updated_at := now();
+  return new;
+end
+$$;
+
+drop trigger if exists internacoes_set_updated_at on public.internacoes;
+create trigger internacoes_set_updated_at
+  before update on public.internacoes
+  for each row execute function public.set_updated_at();
+
+drop trigger if exists procedimentos_set_updated_at on public.procedimentos;
+create trigger procedimentos_set_updated_at
+  before update on public.procedimentos
+  for each row execute function public.set_updated_at();
+
+create index concurrently if not exists internacoes_updated_at_idx   on public.internacoes   (updated_at);
+create index concurrently if not exists procedimentos_updated_at_idx on public.procedimentos (updated_at);
+
+create table if not exists public.deleted_rows (
+  id         bigserial primary key,
+  table_name text        not null,
+  row_id     bigint      not null,
+  deleted_at timestamptz not null default now()
+);
+
+create or replace function public.log_deleted_row()
+returns trigger
+language plpgsql
+security definer
+as $$
+begin
+  insert into public.deleted_rows (table_name, row_id) values (tg_table_name, old.id);
+  return old;
+end
+$$;
+
+drop trigger if exists internacoes_log_delete on public.internacoes;
+create trigger internacoes_log_delete
+  after delete on public.internacoes
+  for each row execute function public.log_deleted_row();
+
+drop trigger if exists procedimentos_log_delete on public.procedimentos;
+create trigger procedimentos_log_delete
+  after delete on public.procedimentos
+  for each row execute function public.log_deleted_row();
+
+grant select on public.deleted_rows to anon, authenticated;
+
+-- Lápides só precisam viver mais que a recarga completa do app (1 h).
+-- Ex. com pg_cron: select cron.schedule('purge-deleted-rows', '0 3 * * *',
+--   $$delete from public.deleted_rows where deleted_at < now() - interval '7 days'$$);
@@ -0,0 +1,24 @@
+-- sql/004_atendimento_key.sql
+-- Chave canônica inteira do atendimento (core.utils.att_key): só dígitos,
+-- sem zeros à esquerda; cai para numero_internacao nas linhas antigas.
+-- Uma busca indexada substitui atendimento + fallback numero_internacao.
+-- Coluna gerada STORED reescreve a tabela uma vez (internacoes é pequena).
+
+create or replace function public.att_key(p_att text, p_num double precision)
+returns bigint
+language sql
+immutable
+as $$
+  select case
+    when length(d) between 1 and 18 then d::bigint
+    when d is null and p_num is not null and p_num < 1e18 then p_num::bigint
+  end
+  from (select nullif(ltrim(regexp_replace(coalesce(p_att, ''), '\D', '', 'g'), '0'), '') as d) s
+$$;
+
+alter table public.internacoes
+  add column if not exists atendimento_key bigint
+  generated always as (public.att_key(atendimento, numero_internacao)) stored;
+
+create index concurrently if not exists internacoes_atendimento_key_idx
+  on public.internacoes (atendimento_key);
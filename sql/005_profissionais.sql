@@ -0,0 +1,43 @@
+-- sql/005_profissionais.sql
+-- Diretório de profissionais distintos (core.crud.listar_profissionais_cache).
+-- Mantido por trigger a cada insert/update de procedimentos.profissional,
+-- então importações, criar_procedimento e restaurações entram sozinhas.
+-- nome_busca (minúsculo) + text_pattern_ops atende o autocomplete por prefixo.
+
+create table if not exists public.profissionais (
+  nome       text primary key,
+  nome_busca text generated always as (lower(nome)) stored,
+  created_at timestamptz not null default now()
+);
+
+create index if not exists profissionais_nome_busca_idx
+  on public.profissionais (nome_busca text_pattern_ops);
+
+create or replace function public.registrar_profissional()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+  if nullif(btrim(new.profissional), '') is not null then
+    insert into public.profissionais (nome) values (btrim(new.profissional))
+    on conflict (nome) do nothing;
+  end if;
+  return new;
+end
+$$;
+
+drop trigger if exists procedimentos_registrar_profissional on public.procedimentos;
+create trigger procedimentos_registrar_profissional
+  after insert or update of profissional on public.procedimentos
+  for each row execute function public.registrar_profissional();
+
+-- Carga inicial (idempotente).
+insert into public.profissionais (nome)
+select distinct btrim(profissional)
+from public.procedimentos
+where nullif(btrim(profissional), '') is not null
+on conflict (nome) do nothing;
+
+grant select on public.profissionais to anon, authenticated;
@@ -0,0 +1,47 @@
+-- sql/006_data_versions.sql
+-- Versão por tabela para o cache do app (core.cache.table_versions):
+-- cada comando que escreve na tabela soma 1. O app lê esta tabelinha
+-- (uma consulta a cada poucos segundos por processo) e só refaz as
+-- leituras pesadas quando a versão das tabelas de que dependem muda.
+-- Trigger por comando (FOR EACH STATEMENT): um lote de importação conta 1.
+
+create table if not exists public.data_versions (
+  table_name text primary key,
+  version    bigint      not null default 0,
+  changed_at timestamptz not null default now()
+);
+
+insert into public.data_versions (table_name)
+values ('hospitals'), ('internacoes'), ('procedimentos')
+on conflict (table_name) do nothing;
+
+create or replace function public.bump_data_version()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+  update public.data_versions
+     set version = version + 1, changed_at = now()
+   where table_name = tg_table_name;
+  return null;
+end
+$$;
+
+drop trigger if exists hospitals_bump_version on public.hospitals;
+create trigger hospitals_bump_version
+  after insert or update or delete or truncate on public.hospitals
+  for each statement execute function public.bump_data_version();
+
+drop trigger if exists internacoes_bump_version on public.internacoes;
+create trigger internacoes_bump_version
+  after insert or update or delete or truncate on public.internacoes
+  for each statement execute function public.bump_data_version();
+
+drop trigger if exists procedimentos_bump_version on public.procedimentos;
+create trigger procedimentos_bump_version
+  after insert or update or delete or truncate on public.procedimentos
+  for each statement execute function public.bump_data_version();
+
+grant select on public.data_versions to anon, authenticated;
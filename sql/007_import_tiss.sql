@@ -0,0 +1,163 @@
+-- sql/007_import_tiss.sql
+-- Importação TISS numa chamada só (tabs/importar.py): recebe os registros
+-- já filtrados em JSON e, numa transação, cria as internações que faltam
+-- (chave canônica atendimento_key, sql/004) e os procedimentos automáticos
+-- (1 por internação/dia). Reimportar o mesmo arquivo não duplica nada.
+-- Datas são comparadas como date (data_procedimento_dt, ou o texto via
+-- pt_date enquanto o backfill não chegou): legado 'aaaa-mm-dd' e o
+-- 'dd/mm/aaaa' do parser são o mesmo dia.
+-- Requer sql/002 (colunas date, pt_date, trigger) e sql/004 (atendimento_key).
+
+-- Unicidade que deixa a importação idempotente também contra corridas com
+-- outras escritas. Só é criada se os dados atuais não têm duplicatas;
+-- senão, avisa (a função segue correta: lock consultivo + NOT EXISTS).
+do $$
+begin
+  if not exists (
+    select 1 from public.internacoes
+     where atendimento_key is not null
+     group by atendimento_key having count(*) > 1
+  ) then
+    create unique index if not exists internacoes_atendimento_key_uniq
+      on public.internacoes (atendimento_key);
+  else
+    raise notice 'internacoes: atendimento_key duplicado, índice único não criado';
+  end if;
+
+  -- Versão anterior indexava o texto da data.
+  drop index if exists public.procedimentos_auto_dia_uniq;
+  if not exists (
+    select 1 from public.procedimentos
+     where is_manual = 0 and data_procedimento_dt is not null
+     group by internacao_id, data_procedimento_dt having count(*) > 1
+  ) then
+    create unique index if not exists procedimentos_auto_dia_dt_uniq
+      on public.procedimentos (internacao_id, data_procedimento_dt) where is_manual = 0;
+  else
+    raise notice 'procedimentos: automático duplicado no mesmo dia, índice único não criado';
+  end if;
+end
+$$;
+
+-- p_registros: [{atendimento, data (dd/mm/aaaa), profissional, paciente, convenio, aviso}, ...]
+-- Retorna {internacoes_criadas, procedimentos_criados, ignorados, atendimento_keys,
+-- internacao_ids}: chaves das internações criadas e internações que ganharam
+-- procedimento, para o app invalidar só o que mudou.
+-- Atendimento = só dígitos, sem zeros à esquerda (core.utils.att_norm).
+-- Casa pela atendimento_key; acima de 18 dígitos (sem chave) casa pelo
+-- texto, como o caminho pelo cliente. Sem o índice único, uma chave pode
+-- ter mais de uma internação: usa a de menor id, nunca uma por duplicata.
+create or replace function public.import_tiss(p_hospital text, p_registros jsonb)
+returns jsonb
+language plpgsql
+as $$
+declare
+  v_int   int;
+  v_proc  int;
+  v_pares int;
+  v_keys  jsonb;
+  v_ids   jsonb;
+begin
+  -- Lista vazia (sonda de core.crud.import_rpc_available): nem lock, nem INSERT
+  -- (que subiria data_versions e derrubaria os caches de todos os processos).
+  if coalesce(jsonb_array_length(p_registros), 0) = 0 then
+    return jsonb_build_object(
+      'internacoes_criadas', 0, 'procedimentos_criados', 0, 'ignorados', 0,
+      'atendimento_keys', '[]'::jsonb, 'internacao_ids', '[]'::jsonb
+    );
+  end if;
+
+  -- Importações simultâneas entram em fila; a unicidade cobre o resto.
+  perform pg_advisory_xact_lock(hashtext('public.import_tiss'));
+
+  with reg as (
+    select nullif(ltrim(regexp_replace(coalesce(r->>'atendimento', ''), '\D', '', 'g'), '0'), '') as n,
+           nullif(btrim(r->>'data'), '')          as data,
+           nullif(btrim(r->>'paciente'), '')      as paciente,
+           nullif(btrim(r->>'convenio'), '')      as convenio,
+           ord
+      from jsonb_array_elements(p_registros) with ordinality as t(r, ord)
+  ),
+  att as (  -- primeiro valor preenchido por atendimento, na ordem do arquivo
+    select n, public.att_key(n, null) as k,
+           (array_agg(paciente order by ord) filter (where paciente is not null))[1] as paciente,
+           (array_agg(convenio order by ord) filter (where convenio is not null))[1] as convenio,
+           (array_agg(data     order by ord) filter (where data     is not null))[1] as data
+      from reg
+     where n is not null and data is not null
+     group by n
+  ),
+  ins as (
+    insert into public.internacoes
+      (hospital, atendimento, paciente, data_internacao, data_internacao_dt, convenio, numero_internacao)
+    select p_hospital, a.n, coalesce(a.paciente, ''),
+           to_char(coalesce(public.pt_date(a.data), current_date), 'DD/MM/YYYY'),
+           coalesce(public.pt_date(a.data), current_date),
+           coalesce(a.convenio, ''), a.n::double precision
+      from att a
+     where not exists (select 1 from public.internacoes i where i.atendimento_key = a.k)
+       and not exists (select 1 from public.internacoes i where a.k is null and i.atendimento = a.n)
+    on conflict do nothing
+    returning atendimento_key
+  )
+  select count(*),
+         coalesce(jsonb_agg(atendimento_key) filter (where atendimento_key is not null), '[]'::jsonb)
+    into v_int, v_keys
+    from ins;
+
+  with reg as (
+    select nullif(ltrim(regexp_replace(coalesce(r->>'atendimento', ''), '\D', '', 'g'), '0'), '') as n,
+           public.pt_date(r->>'data')             as dia,
+           nullif(btrim(r->>'profissional'), '')  as profissional,
+           nullif(btrim(r->>'aviso'), '')         as aviso,
+           ord
+      from jsonb_array_elements(p_registros) with ordinality as t(r, ord)
+  ),
+  par as (  -- um por (atendimento, dia)
+    select n, public.att_key(n, null) as k, dia,
+           (array_agg(profissional order by ord) filter (where profissional is not null))[1] as profissional,
+           (array_agg(aviso        order by ord) filter (where aviso        is not null))[1] as aviso
+      from reg
+     where n is not null and dia is not null
+     group by n, dia
+  ),
+  ins as (
+    insert into public.procedimentos
+      (internacao_id, data_procedimento, data_procedimento_dt, profissional, procedimento,
+       situacao, observacao, is_manual, aviso, grau_participacao)
+    select i.id, to_char(p.dia, 'DD/MM/YYYY'), p.dia, p.profissional, 'Cirurgia / Procedimento',
+           'Pendente', null, 0, p.aviso, null
+      from par p
+      cross join lateral (  -- uma internação por atendimento, mesmo com duplicatas
+        select c.id from (
+          select ii.id from public.internacoes ii where ii.atendimento_key = p.k
+          union all
+          select ii.id from public.internacoes ii where p.k is null and ii.atendimento = p.n
+        ) c
+        order by c.id
+        limit 1
+      ) i
+     where p.profissional is not null
+       and not exists (
+         select 1 from public.procedimentos x
+          where x.internacao_id = i.id and x.is_manual = 0
+            and coalesce(x.data_procedimento_dt, public.pt_date(x.data_procedimento)) = p.dia
+       )
+    on conflict do nothing
+    returning internacao_id
+  ),
+  tot as (select count(*) as n from par)
+  select (select count(*) from ins),
+         (select n from tot),
+         coalesce((select jsonb_agg(distinct internacao_id) from ins), '[]'::jsonb)
+    into v_proc, v_pares, v_ids;
+
+  return jsonb_build_object(
+    'internacoes_criadas',   v_int,
+    'procedimentos_criados', v_proc,
+    'ignorados',             v_pares - v_proc,
+    'atendimento_keys',      v_keys,
+    'internacao_ids',        v_ids
+  );
+end
+$$;
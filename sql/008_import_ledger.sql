@@ -0,0 +1,23 @@
+-- sql/008_import_ledger.sql
+-- Registro das importações TISS (tabs/importar.py), por conteúdo do arquivo:
+-- sha256 dos bytes enviados + escopo (hospital e médicos selecionados).
+-- A importação grava em blocos de atendimentos e marca cada bloco concluído;
+-- reenviar o mesmo arquivo continua do próximo bloco, e um arquivo já
+-- importado por inteiro volta na hora, sem nenhuma leitura nas tabelas.
+
+create table if not exists public.import_ledger (
+  sha256        text        not null,
+  escopo        text        not null,
+  hospital      text        not null,
+  arquivo       text        not null default '',
+  total_blocos  int         not null,
+  blocos_feitos int         not null default 0,
+  concluido     boolean     not null default false,
+  resultado     jsonb       not null default '{}'::jsonb,  -- contagens acumuladas
+  created_at    timestamptz not null default now(),
+  updated_at    timestamptz not null default now(),
+  primary key (sha256, escopo)
+);
+
+create index if not exists import_ledger_updated_idx
+  on public.import_ledger (updated_at desc);
@@ -10,9 +10,12 @@ from core.crud import (
     listar_profissionais_cache, get_procedimentos, reverter_quitacao
 )
 from core.utils import pt_date_to_dt, to_ddmmyyyy, fmt_id_str, format_currency_br
-from core.context import sb
-from core.sb_client import sb_debug_error
-from postgrest import APIError
+
+PROC_VIEW_COLS = [
+    "id", "data_procedimento", "profissional", "procedimento", "situacao", "observacao", "aviso", "grau_participacao",
+    "quitacao_data", "quitacao_guia_amhptiss", "quitacao_valor_amhptiss", "quitacao_guia_complemento",
+    "quitacao_valor_complemento", "quitacao_observacao",
+]
 
 def render():
     tab_header_with_home("🔍 Consultar Internação", btn_key_suffix="consulta")
@@ -83,15 +86,10 @@ def render():
                 st.info("Confirmação inválida. Digite APAGAR.")
 
     # ===== Procedimentos =====
-    try:
-        res_p = sb().table("procedimentos").select(
-            "id, data_procedimento, profissional, procedimento, situacao, observacao, aviso, grau_participacao, "
-            "quitacao_data, quitacao_guia_amhptiss, quitacao_valor_amhptiss, quitacao_guia_complemento, quitacao_valor_complemento, quitacao_observacao"
-        ).eq("internacao_id", internacao_id).execute()
-        df_proc = pd.DataFrame(res_p.data or [])
-    except APIError as e:
-        sb_debug_error(e, "Falha ao carregar procedimentos.")
-        df_proc = pd.DataFrame()
+    # cache por internação, remendado pelas escritas (sem nova leitura após salvar)
+    df_proc = get_procedimentos(internacao_id)
+    if not df_proc.empty:
+        df_proc = df_proc[[c for c in PROC_VIEW_COLS if c in df_proc.columns]]
 
     if df_proc.empty:
         st.subheader("Procedimentos")
@@ -100,7 +98,7 @@ def render():
 
     # normaliza aviso para exibição
     if "aviso" in df_proc.columns:
-        df_proc["aviso"] = df_proc["aviso"].apply(fmt_id_str)
+        df_proc = df_proc.assign(aviso=df_proc["aviso"].apply(fmt_id_str))
 
     st.subheader("Procedimentos — Editáveis")
     edited = st.data_editor(
@@ -1,11 +1,10 @@
 # tabs/home.py
 import streamlit as st
-import pandas as pd
-from datetime import date, datetime
+from datetime import date
 
 from core.ui import kpi_row
-from core.crud import get_hospitais, home_fetch_base_df
-from core.utils import pt_date_to_dt
+from core.crud import get_hospitais, status_totals
+from core.filters import ProcFilter
 
 def render(use_db_view: bool = False):
     st.subheader("🏠 Tela Inicial")
@@ -40,39 +39,15 @@ def render(use_db_view: bool = False):
         with cold4:
             proc_fim = st.date_input("Procedimento — fim", value=st.session_state.get("home_f_proc_fim", hoje), key="home_f_proc_fim")
 
-    df_all = home_fetch_base_df(use_db_view=use_db_view)
-
-    if df_all.empty:
-        df_f = df_all.copy()
-    else:
-        df_all["_int_dt"] = df_all["data_internacao"].apply(pt_date_to_dt)
-        df_all["_proc_dt"] = df_all["data_procedimento"].apply(pt_date_to_dt)
-
-        mask = pd.Series([True] * len(df_all), index=df_all.index)
-
-        if filtro_hosp_home != "Todos":
-            mask &= (df_all["hospital"] == filtro_hosp_home)
-
-        if use_int_range:
-            mask &= df_all["_int_dt"].notna()
-            mask &= (df_all["_int_dt"] >= st.session_state["home_f_int_ini"])
-            mask &= (df_all["_int_dt"] <= st.session_state["home_f_int_fim"])
-
-        if use_proc_range:
-            mask &= df_all["_proc_dt"].notna()
-            mask &= (df_all["_proc_dt"] >= st.session_state["home_f_proc_ini"])
-            mask &= (df_all["_proc_dt"] <= st.session_state["home_f_proc_fim"])
-
-        df_f = df_all[mask].copy()
-
-    def _count_status(df: pd.DataFrame, status: str) -> int:
-        if df is None or df.empty or "situacao" not in df.columns:
-            return 0
-        return int((df["situacao"] == status).sum())
-
-    tot_pendente = _count_status(df_f, "Pendente")
-    tot_finalizado = _count_status(df_f, "Finalizado")
-    tot_nao_cobrar = _count_status(df_f, "Não Cobrar")
+    flt = ProcFilter(
+        hospital=None if filtro_hosp_home == "Todos" else filtro_hosp_home,
+        int_range=(st.session_state["home_f_int_ini"], st.session_state["home_f_int_fim"]) if use_int_range else None,
+        proc_range=(st.session_state["home_f_proc_ini"], st.session_state["home_f_proc_fim"]) if use_proc_range else None,
+    )
+    totais = status_totals(("Pendente", "Finalizado", "Não Cobrar"), flt, use_db_view=use_db_view)
+    tot_pendente = totais["Pendente"]
+    tot_finalizado = totais["Finalizado"]
+    tot_nao_cobrar = totais["Não Cobrar"]
 
     kpi_row([
         {"label": "Pendentes", "value": str(tot_pendente), "hint": "Todos os procedimentos"},
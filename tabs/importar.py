@@ -1,21 +1,28 @@
 # tabs/importar.py
+import hashlib
 import streamlit as st
 import pandas as pd
 from datetime import date
+from typing import Optional
 
 from core.ui import tab_header_with_home, kpi_row, ALWAYS_SELECTED_PROS, pill
-from core.crud import get_hospitais
-from core.utils import att_norm, att_to_number, to_ddmmyyyy
-from core.cache import invalidate_caches
+from core.crud import (
+    get_hospitais, import_rpc_available, importar_tiss, ledger_checkpoint, ledger_get, with_typed_dates,
+)
+from core.utils import att_key, att_norm, att_to_number, to_ddmmyyyy
+from core.cache import invalidate
 from core.context import sb
+from core.paging import fetch_in
 from core.sb_client import sb_debug_error
 from postgrest import APIError
 
 try:
-    from parser import parse_tiss_original
+    from parser import CHUNK_SIZE, ParseStats, parse_tiss_original
 except Exception:
     parse_tiss_original = None
 
+IMPORT_BLOCK_ATTS = 1000  # atendimentos por bloco (um checkpoint no registro por bloco)
+
 def render():
     tab_header_with_home("📤 Importar arquivo", btn_key_suffix="import")
 
@@ -34,14 +41,15 @@ def render():
         st.markdown("</div>", unsafe_allow_html=True)
         return
 
-    raw_bytes = arquivo.getvalue()
-    try:
-        csv_text = raw_bytes.decode("latin1")
-    except UnicodeDecodeError:
-        csv_text = raw_bytes.decode("utf-8-sig", errors="ignore")
-
-    registros = parse_tiss_original(csv_text)
+    # Lido em blocos direto do upload (sem decodificar o arquivo inteiro).
+    sha256 = _file_sha256(arquivo)
+    stats = ParseStats()
+    registros = parse_tiss_original(arquivo, stats)
     st.success(f"{len(registros)} registros interpretados!")
+    st.caption(
+        f"{stats.bytes_read / 1e6:.1f} MB em {stats.seconds:.1f}s ({stats.mb_per_s:.1f} MB/s) · "
+        f"{stats.encoding}, separador '{stats.delimiter}'"
+    )
 
     pros = sorted({(r.get("profissional") or "").strip() for r in registros if r.get("profissional")})
     pares = sorted({(r.get("atendimento"), r.get("data")) for r in registros if r.get("atendimento") and r.get("data")})
@@ -89,15 +97,102 @@ def render():
         unsafe_allow_html=True
     )
 
+    # Mesmo arquivo (sha256) com o mesmo hospital/seleção: mesma importação.
+    escopo = hashlib.sha256("\n".join([hospital or "", *(["*"] if import_all else final_pros)]).encode()).hexdigest()[:16]
+    led = ledger_get(sha256, escopo)
+    if led and led.get("concluido"):
+        st.info(f"Este arquivo já foi importado para {hospital} com esta seleção ({(led.get('updated_at') or '')[:10]}).")
+    elif led:
+        st.info(f"Importação anterior interrompida: {led['blocos_feitos']} de {led['total_blocos']} bloco(s) gravado(s). "
+                "Gravar continua do próximo bloco.")
+
     colg1, _ = st.columns([1, 4])
     with colg1:
         if st.button("Gravar no banco", type="primary", key="import_csv_gravar"):
-            _import_turbo(hospital, registros_filtrados, pares)
+            _import_resumable(hospital, registros_filtrados, sha256, escopo, arquivo.name, led)
 
     st.markdown("</div>", unsafe_allow_html=True)
 
-def _import_turbo(hospital: str, registros_filtrados: list[dict], pares: list[tuple]):
+def _file_sha256(arquivo) -> str:
+    h = hashlib.sha256()
+    arquivo.seek(0)
+    for block in iter(lambda: arquivo.read(CHUNK_SIZE), b""):
+        h.update(block)
+    arquivo.seek(0)
+    return h.hexdigest()
+
+def _blocos(registros: list[dict]) -> list[list[dict]]:
+    """Blocos de IMPORT_BLOCK_ATTS atendimentos, em ordem fixa (mesmo arquivo -> mesmos blocos)."""
+    por_att: dict[str, list[dict]] = {}
+    for r in registros:
+        por_att.setdefault(r.get("atendimento") or "", []).append(r)
+    atts = sorted(por_att)
+    return [[r for a in atts[i:i + IMPORT_BLOCK_ATTS] for r in por_att[a]]
+            for i in range(0, len(atts), IMPORT_BLOCK_ATTS)] or [[]]
+
+def _import_resumable(hospital: str, registros_filtrados: list[dict], sha256: str, escopo: str,
+                      nome: str, led: Optional[dict]):
+    """
+    Grava bloco a bloco e registra cada bloco concluído (sql/008_import_ledger.sql).
+    Arquivo já importado volta na hora; interrompido continua do próximo bloco
+    (cada bloco é idempotente, então refazer um bloco pela metade não duplica).
+    """
+    res = dict((led or {}).get("resultado") or {})
+    if led and led.get("concluido"):
+        st.info("Nada a gravar: este arquivo já foi importado por inteiro.")
+        return
+
+    blocos = _blocos(registros_filtrados)
+    feitos = int(led["blocos_feitos"]) if led and led.get("total_blocos") == len(blocos) else 0
+    totais = [int(res.get(k, 0)) if feitos else 0 for k in ("internacoes_criadas", "procedimentos_criados", "ignorados")]
+    if feitos:
+        st.info(f"Retomando do bloco {feitos + 1} de {len(blocos)}.")
+
+    prog = st.progress(feitos / len(blocos))
+    for i in range(feitos, len(blocos)):
+        parcial = _import_bloco(hospital, blocos[i])
+        if parcial is None:
+            st.error(f"Importação interrompida no bloco {i + 1} de {len(blocos)}. "
+                     "Envie o mesmo arquivo de novo para continuar de onde parou.")
+            return
+        totais = [a + b for a, b in zip(totais, parcial)]
+        ledger_checkpoint(sha256, escopo, hospital, nome, len(blocos), i + 1, {
+            "internacoes_criadas": totais[0], "procedimentos_criados": totais[1], "ignorados": totais[2],
+        })
+        prog.progress((i + 1) / len(blocos))
+
+    _import_done(*totais)
+
+def _import_bloco(hospital: str, registros: list[dict]) -> Optional[tuple[int, int, int]]:
+    """(internações, automáticos, ignorados) do bloco; None se alguma escrita falhou."""
+    if import_rpc_available():  # uma transação no servidor (sql/007_import_tiss.sql)
+        res = importar_tiss(hospital, registros)
+        if res is None:
+            return None
+        return res.get("internacoes_criadas", 0), res.get("procedimentos_criados", 0), res.get("ignorados", 0)
+    return _import_turbo(hospital, registros)
+
+def _import_turbo(hospital: str, registros_filtrados: list[dict]) -> Optional[tuple[int, int, int]]:
     total_criados = total_ignorados = total_internacoes = 0
+    pares = sorted({(r["atendimento"], r["data"]) for r in registros_filtrados if r.get("atendimento") and r.get("data")})
+
+    # Uma passada no arquivo: primeiro valor preenchido por atendimento e por
+    # (atendimento, data), no lugar de varrer os registros a cada item.
+    por_att: dict[str, dict] = {}
+    por_par: dict[tuple, dict] = {}
+    for r in registros_filtrados:
+        att = r.get("atendimento")
+        if not att:
+            continue
+        info = por_att.setdefault(att, {})
+        for k in ("paciente", "convenio", "data"):
+            if r.get(k) and k not in info:
+                info[k] = r[k]
+        if r.get("data"):
+            dia = por_par.setdefault((att, r["data"]), {})
+            for k in ("profissional", "aviso"):
+                if r.get(k) and k not in dia:
+                    dia[k] = r[k]
 
     atts_file = sorted({att for (att, d) in pares if att})
     orig_to_norm = {att: att_norm(att) for att in atts_file}
@@ -106,13 +201,11 @@ def _import_turbo(hospital: str, registros_filtrados: list[dict], pares: list[tu
 
     existing_map_norm_to_id = {}
     try:
-        if norm_set:
-            res_int = sb().table("internacoes").select("id, atendimento").in_("atendimento", norm_set).execute()
-            for r in (res_int.data or []):
-                existing_map_norm_to_id[str(r["atendimento"])] = int(r["id"])
+        # Arquivos grandes: lotes que cabem na URL, lidos em paralelo (core.paging.fetch_in).
+        for r in fetch_in("internacoes", "id, atendimento", "atendimento", norm_set):
+            existing_map_norm_to_id[str(r["atendimento"])] = int(r["id"])
         if num_set:
-            res_int_num = sb().table("internacoes").select("id, numero_internacao").in_("numero_internacao", num_set).execute()
-            for r in (res_int_num.data or []):
+            for r in fetch_in("internacoes", "id, numero_internacao", "numero_internacao", num_set):
                 # normaliza chave a partir do número
                 try:
                     k = att_norm(str(int(float(r["numero_internacao"]))))
@@ -121,7 +214,7 @@ def _import_turbo(hospital: str, registros_filtrados: list[dict], pares: list[tu
                 existing_map_norm_to_id[k] = int(r["id"])
     except APIError as e:
         sb_debug_error(e, "Falha ao buscar internações existentes.")
-        existing_map_norm_to_id = {}
+        return None
 
     to_create_int = []
     for att in atts_file:
@@ -129,19 +222,19 @@ def _import_turbo(hospital: str, registros_filtrados: list[dict], pares: list[tu
         if not na or na in existing_map_norm_to_id:
             continue
 
-        itens_att = [r for r in registros_filtrados if r.get("atendimento") == att]
-        paciente = next((x.get("paciente") for x in itens_att if x.get("paciente")), "") if itens_att else ""
-        conv_total = next((x.get("convenio") for x in itens_att if x.get("convenio")), "") if itens_att else ""
-        data_int = next((x.get("data") for x in itens_att if x.get("data")), None)
+        info = por_att.get(att, {})
+        paciente = info.get("paciente", "")
+        conv_total = info.get("convenio", "")
+        data_int = info.get("data")
 
-        to_create_int.append({
+        to_create_int.append(with_typed_dates({
             "hospital": hospital,
             "atendimento": na,
             "paciente": paciente,
             "data_internacao": to_ddmmyyyy(data_int) if data_int else to_ddmmyyyy(date.today()),
             "convenio": conv_total,
             "numero_internacao": att_to_number(att),
-        })
+        }))
 
     def _chunked_insert(table: str, rows: list, chunk: int = 500):
         for i in range(0, len(rows), chunk):
@@ -150,14 +243,14 @@ def _import_turbo(hospital: str, registros_filtrados: list[dict], pares: list[tu
     if to_create_int:
         try:
             _chunked_insert("internacoes", to_create_int, 500)
-            if norm_set:
-                res_int2 = sb().table("internacoes").select("id, atendimento").in_("atendimento", norm_set).execute()
-                for r in (res_int2.data or []):
-                    existing_map_norm_to_id[str(r["atendimento"])] = int(r["id"])
+            for r in fetch_in("internacoes", "id, atendimento", "atendimento", [x["atendimento"] for x in to_create_int]):
+                existing_map_norm_to_id[str(r["atendimento"])] = int(r["id"])
             total_internacoes = len(to_create_int)
-            invalidate_caches()
+            invalidate(f"hospital:{hospital}", *(f"atendimento:{att_key(r['atendimento'])}" for r in to_create_int))
         except APIError as e:
             sb_debug_error(e, "Falha ao criar internações em lote.")
+            invalidate(f"hospital:{hospital}")  # parte dos lotes pode ter entrado
+            return None
 
     att_to_id = {att: existing_map_norm_to_id.get(orig_to_norm.get(att)) for att in atts_file}
     target_iids = sorted({iid for iid in att_to_id.values() if iid})
@@ -165,19 +258,16 @@ def _import_turbo(hospital: str, registros_filtrados: list[dict], pares: list[tu
     existing_auto = set()
     try:
         if target_iids:
-            res_auto = (
-                sb().table("procedimentos")
-                .select("internacao_id, data_procedimento, is_manual")
-                .in_("internacao_id", target_iids).eq("is_manual", 0)
-                .execute()
-            )
-            for r in (res_auto.data or []):
+            res_auto = fetch_in("procedimentos", "internacao_id, data_procedimento, is_manual", "internacao_id",
+                                target_iids, filters=lambda q: q.eq("is_manual", 0))
+            for r in res_auto:
                 iid = int(r["internacao_id"])
                 dt = to_ddmmyyyy(r.get("data_procedimento"))
                 if iid and dt:
                     existing_auto.add((iid, dt))
     except APIError as e:
         sb_debug_error(e, "Falha ao buscar procedimentos existentes.")
+        return None
 
     to_insert_auto = []
     for (att, data_proc) in pares:
@@ -194,16 +284,15 @@ def _import_turbo(hospital: str, registros_filtrados: list[dict], pares: list[tu
             total_ignorados += 1
             continue
 
-        prof_dia = next((it.get("profissional") for it in registros_filtrados
-                         if it.get("atendimento") == att and it.get("data") == data_proc and it.get("profissional")), "")
-        aviso_dia = next((it.get("aviso") for it in registros_filtrados
-                          if it.get("atendimento") == att and it.get("data") == data_proc and it.get("aviso")), "")
+        dia = por_par.get((att, data_proc), {})
+        prof_dia = dia.get("profissional", "")
+        aviso_dia = dia.get("aviso", "")
 
         if not prof_dia:
             total_ignorados += 1
             continue
 
-        to_insert_auto.append({
+        to_insert_auto.append(with_typed_dates({
             "internacao_id": int(iid),
             "data_procedimento": data_norm,
             "profissional": prof_dia,
@@ -213,17 +302,23 @@ def _import_turbo(hospital: str, registros_filtrados: list[dict], pares: list[tu
             "is_manual": 0,
             "aviso": aviso_dia or None,
             "grau_participacao": None
-        })
+        }))
         existing_auto.add((iid, data_norm))
 
     if to_insert_auto:
         try:
             _chunked_insert("procedimentos", to_insert_auto, 500)
-            invalidate_caches()
+            invalidate(*(f"procedimentos:{iid}" for iid in sorted({r["internacao_id"] for r in to_insert_auto})),
+                       f"hospital:{hospital}", "profissionais")
             total_criados = len(to_insert_auto)
         except APIError as e:
             sb_debug_error(e, "Falha ao inserir procedimentos em lote.")
+            invalidate(f"hospital:{hospital}")  # parte dos lotes pode ter entrado
+            return None
+
+    return total_internacoes, total_criados, total_ignorados
 
+def _import_done(total_internacoes: int, total_criados: int, total_ignorados: int):
     st.success(
         f"Concluído! Internações criadas: {total_internacoes} | Automáticos criados: {total_criados} | Ignorados: {total_ignorados}"
     )
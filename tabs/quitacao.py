@@ -4,6 +4,7 @@ import pandas as pd
 
 from core.ui import tab_header_with_home
 from core.crud import get_hospitais, quitacao_pendentes_base_df, quitar_procedimento
+from core.filters import ProcFilter
 from core.utils import to_ddmmyyyy, to_float_or_none, fmt_id_str
 
 def render(use_db_view: bool = False):
@@ -14,18 +15,19 @@ def render(use_db_view: bool = False):
     hosp_sel = st.selectbox("Hospital", hosp_opts, index=0, key="quit_hosp")
     st.markdown("</div>", unsafe_allow_html=True)
 
-    df_quit = quitacao_pendentes_base_df(use_db_view=use_db_view)
-
-    if hosp_sel != "Todos" and not df_quit.empty:
-        df_quit = df_quit[df_quit["hospital"] == hosp_sel]
+    df_quit = quitacao_pendentes_base_df(
+        use_db_view=use_db_view,
+        flt=ProcFilter(hospital=hosp_sel) if hosp_sel != "Todos" else None,
+    )
 
     if df_quit.empty:
         st.info("Não há cirurgias com status 'Enviado para pagamento' para quitação.")
         return
 
-    for col in ["quitacao_guia_amhptiss", "quitacao_guia_complemento"]:
-        if col in df_quit.columns:
-            df_quit[col] = df_quit[col].apply(fmt_id_str)
+    df_quit = df_quit.assign(**{
+        col: df_quit[col].apply(fmt_id_str)
+        for col in ["quitacao_guia_amhptiss", "quitacao_guia_complemento"] if col in df_quit.columns
+    })
 
     st.markdown("Preencha os dados e clique em **Gravar quitação(ões)**. Ao gravar, status vira **Finalizado**.")
     edited = st.data_editor(
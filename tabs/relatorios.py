@@ -4,9 +4,10 @@ import pandas as pd
 from datetime import date, datetime
 
 from core.ui import tab_header_with_home, STATUS_OPCOES
-from core.crud import get_hospitais, rel_cirurgias_base_df, rel_quitacoes_base_df
-from core.utils import pt_date_to_dt, fmt_id_str
-from core.reports import excel_quitacoes_colunas_fixas
+from core.crud import data_version, get_hospitais, rel_cirurgias_base_df, rel_quitacoes_base_df
+from core.filters import ProcFilter
+from core.utils import fmt_id_str
+from core.reports import excel_quitacoes_colunas_fixas, report_artifact
 
 # PDF: você pode mover suas funções enormes para core/reports.py depois
 REPORTLAB_OK = True
@@ -15,6 +16,27 @@ try:
 except Exception:
     REPORTLAB_OK = False
 
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+def _download_on_demand(label: str, key: tuple, build, file_name: str, mime: str, btn_key: str):
+    """Gera só quando pedido (memo em core.reports); depois mostra o download."""
+    asked = st.session_state.get(f"{btn_key}_req") == key
+    if not asked and st.button(f"Gerar {label}", key=btn_key):
+        st.session_state[f"{btn_key}_req"] = key
+        asked = True
+    if asked:
+        with st.spinner(f"Gerando {label}..."):
+            data = report_artifact(key, build)
+        st.download_button(f"⬇️ Baixar {label}", data=data, file_name=file_name, mime=mime, key=f"{btn_key}_dl")
+
+def _quit_export_df(df: pd.DataFrame) -> pd.DataFrame:
+    """Guias como texto e vazios no lugar de nulos (CSV/Excel)."""
+    df = df.assign(**{
+        col: df[col].apply(fmt_id_str)
+        for col in ["quitacao_guia_amhptiss", "quitacao_guia_complemento", "aviso"] if col in df.columns
+    })
+    return df.astype(object).fillna("")  # categorias/Int64 não aceitam ""
+
 def render(use_db_view: bool = False):
     tab_header_with_home("📑 Relatórios — Central", btn_key_suffix="relatorios")
 
@@ -32,16 +54,12 @@ def render(use_db_view: bool = False):
         dt_ini = st.date_input("Data inicial", value=ini_default, key="rel_ini")
         dt_fim = st.date_input("Data final", value=hoje, key="rel_fim")
 
-    df_rel = rel_cirurgias_base_df(use_db_view=use_db_view)
-    if not df_rel.empty:
-        df_rel["_dt"] = df_rel["data_procedimento"].apply(pt_date_to_dt)
-        df_rel = df_rel[df_rel["_dt"].notna()].copy()
-        df_rel = df_rel[(df_rel["_dt"] >= dt_ini) & (df_rel["_dt"] <= dt_fim)]
-        if hosp_sel != "Todos":
-            df_rel = df_rel[df_rel["hospital"] == hosp_sel]
-        if status_sel != "Todos":
-            df_rel = df_rel[df_rel["situacao"] == status_sel]
-        df_rel = df_rel.drop(columns=["_dt"], errors="ignore")
+    flt_rel = ProcFilter(
+        hospital=None if hosp_sel == "Todos" else hosp_sel,
+        situacoes=() if status_sel == "Todos" else (status_sel,),
+        proc_range=(dt_ini, dt_fim),
+    )
+    df_rel = rel_cirurgias_base_df(use_db_view=use_db_view, flt=flt_rel)
 
     colc1, colc2 = st.columns(2)
     with colc1:
@@ -55,8 +73,11 @@ def render(use_db_view: bool = False):
 
     with colc2:
         if not df_rel.empty:
-            csv_bytes = df_rel.to_csv(index=False).encode("utf-8-sig")
-            st.download_button("⬇️ Baixar CSV", data=csv_bytes, file_name=f"cirurgias_{date.today():%Y%m%d}.csv", mime="text/csv")
+            _download_on_demand(
+                "CSV", ("cirurgias_csv", flt_rel, data_version(use_db_view, flt_rel)),
+                lambda: df_rel.to_csv(index=False).encode("utf-8-sig"),
+                f"cirurgias_{date.today():%Y%m%d}.csv", "text/csv", "btn_csv_cir",
+            )
 
     st.divider()
 
@@ -72,32 +93,26 @@ def render(use_db_view: bool = False):
         dt_ini_q = st.date_input("Data inicial da quitação", value=ini_default_q, key="rel_q_ini")
         dt_fim_q = st.date_input("Data final da quitação", value=hoje, key="rel_q_fim")
 
-    df_quit = rel_quitacoes_base_df(use_db_view=use_db_view)
-    if not df_quit.empty:
-        df_quit["_qdt"] = df_quit["quitacao_data"].apply(pt_date_to_dt)
-        df_quit = df_quit[df_quit["_qdt"].notna()].copy()
-        df_quit = df_quit[(df_quit["_qdt"] >= dt_ini_q) & (df_quit["_qdt"] <= dt_fim_q)]
-        if hosp_sel_q != "Todos":
-            df_quit = df_quit[df_quit["hospital"] == hosp_sel_q]
-
-        for col in ["quitacao_guia_amhptiss", "quitacao_guia_complemento", "aviso"]:
-            if col in df_quit.columns:
-                df_quit[col] = df_quit[col].apply(fmt_id_str)
-
-        df_quit = df_quit.drop(columns=["_qdt"], errors="ignore").fillna("")
+    flt_quit = ProcFilter(
+        hospital=None if hosp_sel_q == "Todos" else hosp_sel_q,
+        quit_range=(dt_ini_q, dt_fim_q),
+    )
+    df_quit = rel_quitacoes_base_df(use_db_view=use_db_view, flt=flt_quit)
+    ver_quit = data_version(use_db_view, flt_quit)
 
     colb1, colb2 = st.columns(2)
     with colb1:
         if not df_quit.empty:
-            csv_quit = df_quit.to_csv(index=False).encode("utf-8-sig")
-            st.download_button("⬇️ Baixar CSV (Quitações)", data=csv_quit, file_name=f"quitacoes_{date.today():%Y%m%d}.csv", mime="text/csv")
+            _download_on_demand(
+                "CSV (Quitações)", ("quitacoes_csv", flt_quit, ver_quit),
+                lambda: _quit_export_df(df_quit).to_csv(index=False).encode("utf-8-sig"),
+                f"quitacoes_{date.today():%Y%m%d}.csv", "text/csv", "btn_csv_quit",
+            )
 
     with colb2:
         if not df_quit.empty:
-            xlsx = excel_quitacoes_colunas_fixas(df_quit)
-            st.download_button(
-                "⬇️ Baixar Excel (layout fixo)",
-                data=xlsx,
-                file_name=f"quitacoes_{date.today():%Y%m%d}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            _download_on_demand(
+                "Excel (layout fixo)", ("quitacoes_xlsx", flt_quit, ver_quit),
+                lambda: excel_quitacoes_colunas_fixas(_quit_export_df(df_quit)),
+                f"quitacoes_{date.today():%Y%m%d}.xlsx", XLSX_MIME, "btn_xlsx_quit",
             )
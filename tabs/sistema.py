@@ -7,7 +7,10 @@ from core.backup import (
     export_tables_to_zip, upload_zip_to_storage, list_backups_from_storage,
     download_backup_from_storage, restore_from_zip, now_ts
 )
+from core.backfill import backfill_datas, pending_rows
+from core.cache import invalidate_caches
 from core.context import sb
+from core.crud import typed_dates_available, typed_dates_ready
 from core.sb_client import sb_debug_error
 
 def render():
@@ -124,6 +127,30 @@ def render():
                 for d in rep.get("details", []):
                     st.write("• " + d)
 
+    st.markdown("---")
+    st.markdown("**🗓️ Datas tipadas (migração)**")
+    st.caption("Preenche as colunas date (sql/002_datas_iso.sql) a partir do texto dd/mm/aaaa. "
+               "Roda em lotes; pode ser interrompido e retomado com o sistema em uso.")
+    if not typed_dates_available():
+        st.info("Colunas date ainda não existem. Aplique sql/002_datas_iso.sql no banco.")
+    else:
+        try:
+            faltam = pending_rows()
+        except APIError as e:
+            sb_debug_error(e, "Falha ao contar datas pendentes.")
+            faltam = None
+        if faltam is not None:
+            st.caption(f"Linhas pendentes: {faltam}")
+        if st.button("🗓️ Migrar datas", key="btn_backfill_datas", disabled=(faltam == 0)):
+            prog = st.empty()
+            try:
+                rep = backfill_datas(on_progress=lambda t, c, n: prog.caption(f"{t}.{c}: {n} linha(s)"))
+                typed_dates_ready.clear()
+                invalidate_caches()
+                st.success("Migração concluída: " + ", ".join(f"{k}={v}" for k, v in rep.items()))
+            except APIError as e:
+                sb_debug_error(e, "Falha na migração (rode de novo para retomar).")
+
     st.markdown("---")
     st.markdown("**🔌 Conexão Supabase**")
     try:
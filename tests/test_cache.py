@@ -0,0 +1,45 @@
+# tests/test_cache.py
+import pytest
+
+from core import cache
+
+
+@pytest.fixture
+def versions():
+    current = {"procedimentos": 1}
+    cache.set_version_source(lambda: dict(current))
+    yield current
+    cache.set_version_source(None)
+
+
+def test_patch_survives_own_write_within_poll(versions):
+    calls = []
+
+    @cache.cached(ttl=60, tags=("procedimentos:{iid}",))
+    def get(iid):
+        calls.append(iid)
+        return [f"v{len(calls)}"]
+
+    assert get(7) == ["v1"]
+    assert cache.table_versions() == {"procedimentos": 1}  # leitura guardada por VERSION_POLL
+
+    versions["procedimentos"] += 1  # a escrita deste processo sobe a versão no banco
+    assert get.patch(lambda v: v + ["patched"], 7)
+    cache.invalidate("procedimentos:7", keep=(get,))
+
+    assert get(7) == ["v1", "patched"]
+    assert calls == [7]
+
+
+def test_write_by_other_process_still_refetches(versions):
+    calls = []
+
+    @cache.cached(ttl=60, tags=("procedimentos:{iid}",))
+    def get(iid):
+        calls.append(iid)
+        return len(calls)
+
+    assert get(3) == 1
+    versions["procedimentos"] += 1
+    cache.expire_versions()  # passou o VERSION_POLL
+    assert get(3) == 2
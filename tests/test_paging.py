@@ -0,0 +1,95 @@
+# tests/test_paging.py
+from types import SimpleNamespace
+
+from core import crud
+from core.filters import ProcFilter
+
+
+class _Query:
+    """Query falsa do supabase-py: registra o select e pagina por `id`."""
+    def __init__(self, table, rows, log):
+        self.table, self.rows, self.log = table, rows, log
+        self.cols, self.count = "*", None
+        self.cond, self.desc, self.lim = [], False, None
+
+    @property
+    def not_(self):
+        return self
+
+    def select(self, cols="*", count=None, head=None):
+        self.cols, self.count = cols, count
+        self.log.append((self.table, cols))
+        return self
+
+    def gte(self, col, v):
+        if col == "id":
+            self.cond.append(lambda r: r["id"] >= v)
+        return self
+
+    def gt(self, col, v):
+        if col == "id":
+            self.cond.append(lambda r: r["id"] > v)
+        return self
+
+    def lte(self, col, v):
+        if col == "id":
+            self.cond.append(lambda r: r["id"] <= v)
+        return self
+
+    def _noop(self, *a, **k):
+        return self
+
+    eq = in_ = is_ = or_ = _noop
+
+    def order(self, col, desc=False):
+        self.desc = desc
+        return self
+
+    def limit(self, n):
+        self.lim = n
+        return self
+
+    def execute(self):
+        rows = sorted((r for r in self.rows if all(c(r) for c in self.cond)),
+                      key=lambda r: r["id"], reverse=self.desc)
+        total = len(rows)
+        return SimpleNamespace(data=[dict(r) for r in rows[:self.lim]],
+                               count=total if self.count else None)
+
+
+class _Client:
+    def __init__(self, tables):
+        self.tables, self.log = tables, []
+
+    def table(self, name):
+        return _Query(name, self.tables[name], self.log)
+
+
+def _setup(monkeypatch, rows):
+    client = _Client({"procedimentos": rows})
+    monkeypatch.setattr(crud, "sb", lambda: client)
+    monkeypatch.setattr("core.paging.sb", lambda: client)
+    monkeypatch.setattr(crud, "db_view_available", lambda: False)
+    monkeypatch.setattr(crud, "typed_dates_ready", lambda: False)
+    monkeypatch.setattr(crud, "typed_dates_available", lambda view=False: False)
+    return client
+
+
+def _rows(n):
+    return [{"id": i, "internacao_id": i, "internacoes": {"hospital": "H0"}} for i in range(1, n + 1)]
+
+
+def test_bounds_queries_carry_inner_embed(monkeypatch):
+    client = _setup(monkeypatch, _rows(5))
+    df, stats = crud.fetch_proc_join("internacao_id", "hospital", ProcFilter(hospital="H0"))
+    selects = [cols for table, cols in client.log if table == "procedimentos"]
+    assert len(selects) >= 3  # contagem/menor chave, maior chave, páginas
+    assert all("internacoes!inner(hospital)" in cols for cols in selects)
+    assert len(df) == 5 and stats.complete
+
+
+def test_orphan_bounds_queries_carry_embed(monkeypatch):
+    client = _setup(monkeypatch, _rows(3))
+    crud.fetch_proc_join("internacao_id", "hospital", ProcFilter(excluir_hospitais=("H0",)))
+    selects = [cols for table, cols in client.log if table == "procedimentos"]
+    assert selects and all("internacoes" in cols for cols in selects)
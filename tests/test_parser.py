@@ -0,0 +1,26 @@
+# tests/test_parser.py
+from parser import ParseStats, SNIFF_BYTES, parse_tiss_original
+
+HEADER = "Atendimento;Data;Profissional;Paciente;Convenio;Aviso\r\n"
+
+
+def _file(encoding: str) -> bytes:
+    ascii_rows = "".join(f"{i};01/02/2024;DR A;PACIENTE X;SUS;{i}\r\n" for i in range(1, 3000))
+    text = HEADER + ascii_rows + "99999;02/02/2024;DR B;JOÃO ÇÃ;SUS;1\r\n"
+    data = text.encode(encoding)
+    assert data[:SNIFF_BYTES].isascii()  # acentos só depois da amostra
+    return data
+
+
+def test_latin1_with_ascii_sample_keeps_accents():
+    stats = ParseStats()
+    recs = parse_tiss_original(_file("latin1"), stats)
+    assert recs[-1]["paciente"] == "JOÃO ÇÃ"
+    assert stats.encoding == "latin1"
+
+
+def test_utf8_with_ascii_sample_stays_utf8():
+    stats = ParseStats()
+    recs = parse_tiss_original(_file("utf-8"), stats)
+    assert recs[-1]["paciente"] == "JOÃO ÇÃ"
+    assert stats.encoding == "utf-8"